@@ -1,5 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
 import os
 
+# Background workers getting molecule data, and how often (ms) the GUI checks if they finished.
+MOL_WORKERS = 2
+MOL_POLL_MS = 50
+# How often (ms) the GUI updates the LIME jobs status while there are active jobs.
+JOBS_POLL_MS = 1000
+# How often (ms) the GUI checks if the shape file scan finished.
+SCAN_POLL_MS = 200
+
+
 class Controller:
     """Controller class. Connects Model and View classes transporting data between them.
     """
@@ -18,6 +28,20 @@ class Controller:
         self.save_dir = None
         self.load_dir = None
 
+        # Molecule data is downloaded and parsed in background threads (one future per molecule)
+        self.mol_executor = ThreadPoolExecutor(max_workers=MOL_WORKERS)
+        self.mol_futures = {}
+        self.mol_callbacks = {}
+        self.requested_mol = None
+        self.mol_poll_scheduled = False
+
+        self.jobs_poll_scheduled = False
+        self.reported_jobs = set()    # finished jobs already reported
+
+        # Shape file data is scanned in a background thread when it is asked (Check file)
+        self.scan_executor = ThreadPoolExecutor(max_workers=1)
+        self.scan_future = None
+
     def set_view(self, view):
         """View setter.
 
@@ -44,6 +68,28 @@ class Controller:
             self.model.datos_pars['shape_file'] = path
             return path
 
+    def check_shapefile(self):
+        """Scans the shape file data without blocking the GUI (its summary is printed when it
+        finishes, see poll_scan). Only the header is checked when clicking Start!
+        """
+        if self.scan_future is not None:
+            return  # already in progress
+        self.scan_future = self.scan_executor.submit(self.model.check_shape, True)
+        self.view.after(SCAN_POLL_MS, self.poll_scan)
+
+    def poll_scan(self):
+        """Shows the errors of the shape file scan when it finishes, and schedules itself again
+        while it is in progress.
+        """
+        if not self.scan_future.done():
+            self.view.after(SCAN_POLL_MS, self.poll_scan)
+            return
+        future, self.scan_future = self.scan_future, None
+        try:
+            future.result()
+        except Exception as err:
+            self.view.popup(str(err))
+
     def change_datos_vars(self, checkbt_val, var):
         """Updates datos_vars dictionary from Model.
 
@@ -61,6 +107,7 @@ class Controller:
         self.model.datos_mol.update(self.view.get_mol())
         self.model.datos_pars.update(self.view.get_datos_pars())
         self.model.datos_img.update(self.view.get_datos_img())
+        self.model.update_extra_trans(self.view.get_extra_trans())
 
     def update_mol(self, mol):
         """Updates molecule information in Model.
@@ -74,6 +121,63 @@ class Controller:
         """
         return self.model.update_mol(mol)
 
+    def request_mol(self, mol, callback):
+        """Gets molecule information without blocking the GUI. Its data is downloaded and parsed in a
+        background worker (only once if it is requested again while in progress) and then callback is
+        called from the GUI thread, if mol is still the last requested molecule.
+
+        Args:
+            mol (str): molecule name.
+            callback (function): function called with the result of update_mol.
+        """
+        self.requested_mol = mol
+        if mol not in self.mol_futures:
+            self.mol_futures[mol] = self.mol_executor.submit(
+                self.model.prefetch_mol, mol)
+        self.mol_callbacks[mol] = callback
+        self.schedule_mol_poll()
+
+    def schedule_mol_poll(self):
+        """Schedules poll_mols in the GUI event loop if it is not already scheduled.
+        """
+        if not self.mol_poll_scheduled:
+            self.mol_poll_scheduled = True
+            self.view.after(MOL_POLL_MS, self.poll_mols)
+
+    def poll_mols(self):
+        """Delivers finished molecule requests (in the GUI thread) and schedules itself again while
+        some of them are in progress.
+        """
+        self.mol_poll_scheduled = False
+        for mol, future in list(self.mol_futures.items()):
+            if not future.done():
+                continue
+            del self.mol_futures[mol]
+            callback = self.mol_callbacks.pop(mol, None)
+            if mol != self.requested_mol:
+                continue  # another molecule was selected meanwhile
+            try:
+                future.result()
+                mol_dic = self.model.update_mol(mol)
+            except Exception as err:
+                self.view.popup(str(err))
+                continue
+            if callback is not None:
+                callback(mol_dic)
+
+        if len(self.mol_futures) > 0:
+            self.schedule_mol_poll()
+
+    def wait_mol(self):
+        """Waits until the last requested molecule is ready and delivers it.
+        """
+        if self.requested_mol in self.mol_futures:
+            try:
+                self.mol_futures[self.requested_mol].result()
+            except Exception:
+                pass  # shown by poll_mols
+            self.poll_mols()
+
     def get_mol_name(self):
         """Gets present molecule name.
 
@@ -139,16 +243,58 @@ class Controller:
             self.view.update_mol(self.model.datos_mol)
             self.view.update_datos_pars(self.model.datos_pars)
             self.view.update_datos_img(self.model.datos_img)
+            self.view.update_extra_trans(self.model.datos_imgs,
+                                         self.model.datos_mol.get('trans', '1'))
 
     def start(self):
         """Updates Model data and calls Model start function.
         """
+        self.wait_mol()
         self.update_data()
         try:
-            self.model.start()
+            job = self.model.start()
+            print('LIME job ' + str(job.job_id) + ' (' + job.name + '): ' + job.status +
+                  ', working folder ' + str(job.run_dir))
         except Exception as err:
             err_text = str(err)
             self.view.popup(err_text)
+        self.refresh_jobs()
+
+    def cancel_jobs(self):
+        """Cancels all the running and queued LIME jobs.
+        """
+        self.model.jobs.cancel_all()
+        self.refresh_jobs()
+
+    def get_jobs(self):
+        """Gets the LIME jobs information.
+
+        Returns:
+            list: jobs information (see jobs.Job info), in submission order.
+        """
+        return [job.info() for job in self.model.jobs.jobs()]
+
+    def poll_jobs(self):
+        """Scheduled in the GUI event loop while some LIME job is active, see refresh_jobs.
+        """
+        self.jobs_poll_scheduled = False
+        self.refresh_jobs()
+
+    def refresh_jobs(self):
+        """Updates the LIME jobs status in View, reports finished jobs and schedules poll_jobs while
+        some of them are active.
+        """
+        jobs = self.get_jobs()
+        for job in jobs:
+            if job['status'] not in ('queued', 'running') and job['id'] not in self.reported_jobs:
+                self.reported_jobs.add(job['id'])
+                print('LIME job ' + str(job['id']) + ' (' + job['name'] + ') ' + job['status'] +
+                      ', output in ' + job['stdout'])
+        self.view.update_jobs(jobs)
+
+        if any(job['status'] in ('queued', 'running') for job in jobs) and not self.jobs_poll_scheduled:
+            self.jobs_poll_scheduled = True
+            self.view.after(JOBS_POLL_MS, self.poll_jobs)
 
     def save_fitsfile(self):
         """Function to open file dialog to choose where to save fits output file.
@@ -1,13 +1,13 @@
 import configparser
+import io
 from pathlib import Path
-from astroquery.lamda import Lamda
-import subprocess as sub
 from inspect import getsourcefile
 from os.path import abspath, dirname
-import warnings
 import shutil
 
-from utils import *
+from jobs import MODEL_FILES, JobManager, lime_command
+from mol_cache import CATALOGUE_MAX_AGE, MolCatalogue, MolTables
+from model_utils import *
 
 
 class Model:
@@ -24,8 +24,10 @@ class Model:
     datos_pars = {}     # general parameters for LIME
     datos_mol = {}      # molecule information
     datos_img = {}      # image parameters for LIME
+    datos_imgs = []     # extra images, parameters that change from datos_img (IMG.1, IMG.2...)
     datos_uds = {}      # units from functions/variables and several parameters
     datos_funcs = {}    # analytic functions
+    datos_fill = {}     # values outside of the file points (linear interpolation), only from bak files
 
     def __init__(self) -> None:
         """Creates Model and initiates LAMDA molecules dictionary.
@@ -35,6 +37,7 @@ class Model:
         ini_config = configparser.ConfigParser()
 
         cfile_path = Path(dirname(abspath(getsourcefile(lambda: 0))))
+        self.src_path = cfile_path
         ini_config.read(Path(cfile_path).parents[0] / "ideate_config.ini")
 
         if 'CONFIG' in ini_config:
@@ -44,19 +47,32 @@ class Model:
             else:
                 self.mol_path = self.ini_dir / '.ideate/mols/'
         else:  # if there is no ini config file (pylime is on the system)
+            ini_config['CONFIG'] = {}
             self.lime_path = None
             self.mol_path = self.ini_dir / '.ideate/mols/'
 
         self.model_path = self.ini_dir / '.ideate/'
         
         Path(self.model_path).mkdir(parents=True, exist_ok=True)
-        shutil.copyfile(cfile_path / "lime_model.py", self.model_path / "lime_model.py")
+        for model_file in MODEL_FILES:
+            shutil.copyfile(cfile_path / model_file, self.model_path / model_file)
         
         Path(self.mol_path).mkdir(parents=True, exist_ok=True)
 
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            self.mol_dic = Lamda.molecule_dict
+        # LAMDA molecule catalogue is saved in mol_path and only downloaded again when it is stale
+        # (mol_max_age days), never if offline. lamda_source can be a local folder with .dat files.
+        self.mol_catalogue = MolCatalogue(self.mol_path,
+                                          max_age=ini_config['CONFIG'].getfloat(
+                                              'mol_max_age', CATALOGUE_MAX_AGE),
+                                          offline=ini_config['CONFIG'].getboolean(
+                                              'offline', False),
+                                          source=ini_config['CONFIG'].get('lamda_source'))
+        self.mol_dic = self.mol_catalogue.molecule_dict()
+        self.mol_tables = MolTables(self.mol_catalogue)
+
+        # LIME runs, at most max_jobs at the same time (the rest are queued)
+        self.jobs = JobManager(self.model_path / 'jobs',
+                               max_running=ini_config['CONFIG'].getint('max_jobs', 1))
         self.mol_load_flag = False
 
     def update_mol(self, mol):
@@ -79,7 +95,7 @@ class Model:
             print('Selected molecule: ', mol)
             print('Link: ', self.mol_dic[mol])
 
-            collrates, radtransitions, enlevels = Lamda.query(mol=mol)
+            collrates, radtransitions, enlevels = self.mol_tables.get(mol)
             print('Complete name: ' + enlevels.meta['molecule'])
             print('Weight: ' + str(enlevels.meta['molwt']))
             print('Number of enerfy levels: ' +
@@ -88,6 +104,15 @@ class Model:
             radtransitions.pprint_all()
             return {'old_mol': old_mol, 'collrates': collrates, 'radtransitions': radtransitions, 'enlevels': enlevels}
 
+    def prefetch_mol(self, mol):
+        """Downloads and parses molecule data, so update_mol gets it from memory. It can be run in
+        a background thread.
+
+        Args:
+            mol (str): molecule name.
+        """
+        self.mol_tables.get(mol)
+
     def create_config(self, check_flag):
         """Creates a configuration file with all the dictionaries information.
 
@@ -142,14 +167,8 @@ class Model:
         config['MOL'] = self.datos_mol
 
         if 'mol_name' in self.datos_mol:
-            fname = self.datos_mol['mol_name'] + ".dat"
-            moldat_path = self.mol_path / fname
-            moldat_path_str = str(moldat_path)
-            if not moldat_path.exists():
-                Lamda.download_molfile(
-                    mol=self.datos_mol['mol_name'], outfilename=moldat_path_str)
-            
-            config['MOL']['moldatfile'] = moldat_path_str
+            moldat_path = self.mol_tables.datafile(self.datos_mol['mol_name'])
+            config['MOL']['moldatfile'] = str(moldat_path)
         else:
             if check_flag:
                 raise Exception("You must choose a molecule!")
@@ -161,6 +180,16 @@ class Model:
 
         config['PARS'] = self.datos_pars
         config['IMG'] = self.datos_img
+        if len(self.datos_fill) > 0:
+            config['FILL'] = self.datos_fill
+
+        # Extra images of the same LIME run (same grid and level populations)
+        for k, img in enumerate(self.datos_imgs, start=1):
+            trans = str(img.get('trans', '1'))
+            if check_flag and not (trans.isdigit() and int(trans) > 0):
+                raise Exception(
+                    "Transition numbers of the extra images must be positive integers!")
+            config['IMG.' + str(k)] = img
 
         return config
 
@@ -186,10 +215,29 @@ class Model:
                 self.datos_pars.update(dict(config['PARS']))
             if 'IMG' in config:
                 self.datos_img.update(dict(config['IMG']))
+                extra = sorted((section for section in config.sections()
+                                if section.startswith('IMG.') and section[4:].isdigit()),
+                               key=lambda section: int(section[4:]))
+                self.datos_imgs = [dict(config[section]) for section in extra]
             if 'FUNCS' in config:
                 self.datos_funcs.update(dict(config['FUNCS']))
+            if 'FILL' in config:
+                self.datos_fill.update(dict(config['FILL']))
             # Careful when reading from configparser: everything is str, no bool!
 
+    def update_extra_trans(self, trans_list):
+        """Sets the transitions of the extra images. Their other parameters (e.g. loaded from a
+        bak file) are kept, and images are added or removed to match trans_list.
+
+        Args:
+            trans_list (list): transition number (str) of each extra image.
+        """
+        imgs = self.datos_imgs[:len(trans_list)]
+        imgs += [{} for _ in range(len(trans_list) - len(imgs))]
+        for img, trans in zip(imgs, trans_list):
+            img['trans'] = trans
+        self.datos_imgs = imgs
+
     def save_bak(self, path):
         """Creates the backup configuration file.
 
@@ -201,34 +249,61 @@ class Model:
             with open(path, 'w') as configfile:
                 config.write(configfile)
 
-    def start(self):
-        """Start function to call LIME. It checks shape file format and creates the config file before starting the execution.
+    def check_shape(self, scan=False, workers=1):
+        """Checks shape file format (only its header). If scan is True, the file is also read once
+        (unless it is cached) and a summary of its data is printed.
+
+        Args:
+            scan (bool, optional): if True, the file data is scanned. Defaults to False.
+            workers (int, optional): processes used to scan the file. Defaults to 1 (see
+                model_utils.check_format).
 
         Raises:
-            Exception: if a shape file wasn't chosen exception will be raised. 
+            Exception: if a shape file wasn't chosen or its format is wrong.
         """
-        if 'shape_file' in self.datos_pars:
-            check_format(self.datos_pars["shape_file"], self.datos_vars)
-            config = self.create_config(check_flag=True)
-            if config:
-                with open(self.model_path / 'lime_config.ini', 'w') as configfile:
-                    config.write(configfile)
-
-            if 'fits_file' in self.datos_pars:
-                config_backup = self.datos_pars['fits_file'].rsplit('.')[
-                    0] + '.bak'
-            else:
-                config_backup = str(self.model_path / 'model.bak')
+        if 'shape_file' not in self.datos_pars:
+            raise Exception("You must choose a file to run the program!")
 
-            with open(config_backup, 'w') as cbfile:
-                config.write(cbfile)
+        stats = check_format(self.datos_pars["shape_file"], self.datos_vars, scan, workers)
+        if stats is None:
+            return
+        print()
+        print('Shape file points: ' + str(stats['n_points']))
+        for c, axis in stats['axes'].items():
+            print(c + ': [' + str(stats['columns'][c]['min']) + ', ' + str(stats['columns'][c]['max']) +
+                  '], ' + str(axis['n_values']) + ' values, max spacing ' + str(axis['max_step']))
+        for c, col in stats['columns'].items():
+            if c not in stats['axes']:
+                print(c + ': [' + str(col['min']) + ', ' + str(col['max']) + '], ' +
+                      str(col['nan']) + ' NaN values')
 
-            # If pylime is already a command program is run directly
-            if self.lime_path is None:
-                command = 'cd ' + str(self.model_path) + ' ; pylime lime_model.py'
-            else:
-                command = 'cd ' + str(self.lime_path) + ' ; . ./pylimerc.sh ; cd ' + \
-                    str(self.model_path) + ' ; pylime lime_model.py'
-            p = sub.Popen(command, shell=True)
+    def start(self):
+        """Start function to call LIME. It checks shape file header and creates the config file before starting the execution.
+
+        Raises:
+            Exception: if a shape file wasn't chosen exception will be raised. 
+
+        Returns:
+            Job: LIME job (see jobs.JobManager), queued if the maximum number of running jobs is reached.
+        """
+        self.check_shape()
+        config = self.create_config(check_flag=True)
+        config_text = io.StringIO()
+        config.write(config_text)
+
+        if 'fits_file' in self.datos_pars:
+            config_backup = self.datos_pars['fits_file'].rsplit('.')[
+                0] + '.bak'
         else:
-            raise Exception("You must choose a file to run the program!")
+            config_backup = str(self.model_path / 'model.bak')
+
+        with open(config_backup, 'w') as cbfile:
+            cbfile.write(config_text.getvalue())
+
+        # Each job runs in its own folder with its config file and model, so runs at the same
+        # time don't use each other's files.
+        return self.jobs.submit(Path(config_backup).stem, lime_command(self.lime_path),
+                                files={'lime_config.ini': config_text.getvalue()},
+                                copy_files=[self.src_path / model_file
+                                            for model_file in MODEL_FILES],
+                                key=config_text.getvalue())
@@ -15,6 +15,7 @@ class View(ttk.Frame):
     """
 
     chosen_mol_dic = {}
+    trans_preview_rows = 5  # transitions shown around the chosen one
 
     def __init__(self, parent, controller) -> None:
         """Generates all View class widgets. 
@@ -25,6 +26,7 @@ class View(ttk.Frame):
         """
         super().__init__(parent)
         self.controller = controller
+        self.jobs_lbls = []     # LIME jobs status, below the Start buttons of each tab
 
         ''' -------------------- '''
         ''' Complete application '''
@@ -47,6 +49,7 @@ class View(ttk.Frame):
         self.inv_unit_dic = {str(val): key for key,
                              val in self.unit_dic.items()}
         self.unit_list = self.unit_dic.keys()
+        self.interpolation_list = ['nearest', 'trilinear', 'linear']
 
         variables = ['px', 'py', 'pz', 'density',
                      'velocity', 'turbulence', 'temperature']
@@ -65,6 +68,13 @@ class View(ttk.Frame):
         self.shapefile_lbl.grid(row=0, column=1, padx=(
             10, 20), pady=(20, 10), sticky="nsew")
 
+        check_shapefile_bt = ttk.Button(
+            ini_tab, text="Check file", command=self.check_shapefile_bt_clicked)
+        check_shapefile_bt.grid(row=0, column=2, padx=(
+            0, 20), pady=(20, 10), sticky="nsew")
+        createToolTip(
+            check_shapefile_bt, text='Reads the file once (in background) and prints the range and NaN values of each column read. Start! only checks the file header.')
+
         # Analytic functions entries
         ini_data_frame = ttk.Frame(ini_tab)
         ini_data_frame.grid(row=1, column=0, padx=(20, 5), pady=(0, 10))
@@ -350,6 +360,25 @@ class View(ttk.Frame):
         ttk.Checkbutton(opt_gral_frame, text="LTE calculation only", variable=self.lte_val).grid(
             row=0, column=0, padx=(20, 0), pady=(0, 5), sticky='w')
 
+        interpolation_lbl = ttk.Label(opt_gral_frame, text="Interpolation")
+        interpolation_lbl.grid(row=1, column=0, padx=(20, 0), sticky='w')
+        createToolTip(
+            interpolation_lbl, text='How values read from the file are taken at each LIME point: from the nearest point of the file, interpolated between the points of a regular grid (trilinear) or interpolated between scattered points (linear).')
+
+        self.interpolation_val = tk.StringVar(opt_gral_frame)
+        interpolation_menu = ttk.OptionMenu(
+            opt_gral_frame, self.interpolation_val, 'nearest', *self.interpolation_list)
+        interpolation_menu.config(width=9)
+        interpolation_menu.grid(row=2, column=0, padx=(
+            20, 0), pady=(0, 5), sticky='w')
+
+        self.pregrid_val = tk.BooleanVar(value=False)
+        pregrid_bt = ttk.Checkbutton(
+            opt_gral_frame, text="Use file points as grid", variable=self.pregrid_val)
+        pregrid_bt.grid(row=3, column=0, padx=(20, 0), pady=(0, 5), sticky='w')
+        createToolTip(
+            pregrid_bt, text='LIME grid is made of the points of the file inside the model radius (Number of points is then ignored). All values are computed at once before LIME starts.')
+
         ''' ---------------- '''
         ''' Image parameters '''
         ''' ---------------- '''
@@ -497,6 +526,7 @@ class View(ttk.Frame):
 
         mol_dic = self.controller.get_mol_dic()
         self.mol_list = list(mol_dic.keys())
+        self.mol_index = SearchIndex(self.mol_list)
         for mol in self.mol_list:
             self.mol_tree.insert('', tk.END, mol, values=mol)
 
@@ -548,6 +578,8 @@ class View(ttk.Frame):
         self.trans_spinbox["state"] = "disabled"
         self.trans_spinbox.bind('<Return>', self.trans_changed_event)
         self.spinbox_len = 1
+        self.trans_rows = []    # rows of the transitions table (tuples)
+        self.trans_pos = {}     # {transition number: row position}
 
         ttk.Label(
             mol_data_tab, text="Relative abundance (r):").grid(row=2, column=0, padx=(
@@ -558,10 +590,18 @@ class View(ttk.Frame):
             row=3, column=0, padx=(20, 5), sticky='nw')
         self.rel_abundance_entry.insert(-1, '1e-9')
 
+        extra_trans_lbl = ttk.Label(mol_data_tab, text="Extra images (transitions):")
+        extra_trans_lbl.grid(row=4, column=0, padx=(20, 5), pady=(10, 0), sticky='nw')
+        createToolTip(
+            extra_trans_lbl, text='Transition numbers separated by commas, e.g. 2, 3. Each one gives another .fits file (named after the output file with the image number added) with the same image parameters, computed in the same LIME run.')
+
+        self.extra_trans_entry = ttk.Entry(mol_data_tab, exportselection=0)
+        self.extra_trans_entry.grid(row=5, column=0, padx=(20, 5), sticky='nw')
+
         lamda_text = tk.Text(mol_data_tab, height=5, width=30, wrap=tk.WORD)
         line1 = "Careful! Lower and upper doesn't refer to the quantum levels. To understand the LAMDA file format click here: "
         lamda_text.insert(tk.END, line1)
-        lamda_text.grid(row=4, column=0, padx=(
+        lamda_text.grid(row=6, column=0, padx=(
             20, 5), pady=(30, 0), sticky='s')
         hyperlink = HyperlinkManager(lamda_text)
 
@@ -571,7 +611,8 @@ class View(ttk.Frame):
         def callback(url):
             webbrowser.open_new_tab(url)
 
-        self.mol_info = ttk.Treeview(mol_tab, height=1, selectmode='browse')
+        self.mol_info = ttk.Treeview(
+            mol_tab, height=self.trans_preview_rows, selectmode='browse')
         self.mol_info.column("#0", width=0, stretch=False)
         self.mol_info.heading("#0", text="", anchor=tk.CENTER)
 
@@ -602,10 +643,18 @@ class View(ttk.Frame):
             if path is not None and len(path) != 0:
                 self.shapefile_lbl.config(text=path.split("/")[-1])
 
+    def check_shapefile_bt_clicked(self):
+        if self.controller:
+            self.controller.check_shapefile()
+
     def start_bt_clicked(self):
         if self.controller:
             self.controller.start()
 
+    def cancel_bt_clicked(self):
+        if self.controller:
+            self.controller.cancel_jobs()
+
     def save_bt_clicked(self):
         if self.controller:
             self.controller.save()
@@ -676,17 +725,41 @@ class View(ttk.Frame):
         popup(text)
 
     def start_save_load_bts(self, frame):
-        """Set of three buttons: Start, Save and Load.
+        """Set of four buttons: Start, Cancel runs, Save and Load, and the LIME jobs status.
 
         Args:
             frame (tk.Frame): frame where the buttons are located.
         """
         ttk.Button(frame, text="Start!", command=self.start_bt_clicked).grid(
             row=0, pady=(0, 5), ipady=10, sticky="nswe")
+        cancel_bt = ttk.Button(frame, text="Cancel runs", command=self.cancel_bt_clicked)
+        cancel_bt.grid(row=1, pady=(5, 5), sticky="nswe")
+        createToolTip(cancel_bt, text='Stops the running LIME jobs and removes the waiting ones.')
         ttk.Button(frame, text="Save parameters", command=self.save_bt_clicked).grid(
-            row=1, pady=(5, 5), sticky="nswe")
+            row=2, pady=(5, 5), sticky="nswe")
         ttk.Button(frame, text="Load parameters", command=self.load_bt_clicked).grid(
-            row=2, pady=(5, 0), sticky="nswe")
+            row=3, pady=(5, 0), sticky="nswe")
+
+        jobs_lbl = ttk.Label(frame, text="")
+        jobs_lbl.grid(row=4, pady=(5, 0))
+        self.jobs_lbls.append(jobs_lbl)
+
+    def update_jobs(self, jobs):
+        """Shows the LIME jobs status below the Start buttons.
+
+        Args:
+            jobs (list): jobs information (see jobs.Job info), in submission order.
+        """
+        n_running = sum(job['status'] == 'running' for job in jobs)
+        n_queued = sum(job['status'] == 'queued' for job in jobs)
+        if n_running + n_queued > 0:
+            text = 'Running: ' + str(n_running) + ', waiting: ' + str(n_queued)
+        elif len(jobs) > 0:
+            text = 'Last run: ' + jobs[-1]['status']
+        else:
+            text = ''
+        for jobs_lbl in self.jobs_lbls:
+            jobs_lbl.config(text=text)
 
     ''' ------------------- '''
     ''' Setters and getters '''
@@ -832,6 +905,10 @@ class View(ttk.Frame):
             self.entry_set_text(self.sinkpoints_entry, pars['sinkpoints'])
         if 'lte' in pars:
             self.lte_val.set(pars['lte'])
+        if 'interpolation' in pars:
+            self.interpolation_val.set(pars['interpolation'])
+        if 'pregrid' in pars:
+            self.pregrid_val.set(pars['pregrid'])
         if 'shape_file' in pars:
             self.shapefile_lbl.config(text=pars['shape_file'].split("/")[-1])
         if 'fits_file' in pars:
@@ -849,6 +926,8 @@ class View(ttk.Frame):
         pars['pintensity'] = self.pintensity_entry.get()
         pars['sinkpoints'] = self.sinkpoints_entry.get()
         pars['lte'] = self.lte_val.get()
+        pars['interpolation'] = self.interpolation_val.get()
+        pars['pregrid'] = self.pregrid_val.get()
         # fits_file
 
         return pars
@@ -903,7 +982,7 @@ class View(ttk.Frame):
         if 'mol_name' in datos_mol:  # TODO: choose molecule in the tree instead...
             mol_name = datos_mol['mol_name']
             if mol_name not in self.mol_tree.get_children(''):
-                self.restore_tree(self.mol_tree, self.mol_list)
+                self.show_tree_items(self.mol_tree, self.mol_list)
                 self.entry_set_text(self.mol_search_entry, '')
             self.mol_tree.selection_set(mol_name)
             # self.new_mol_set(mol_name)
@@ -927,19 +1006,49 @@ class View(ttk.Frame):
 
         return mol
 
+    def update_extra_trans(self, datos_imgs, trans):
+        """Shows the transitions of the extra images.
+
+        Args:
+            datos_imgs (list): extra images dictionaries, they can include {'trans': transition number}.
+            trans (str): transition number of the images without one.
+        """
+        self.entry_set_text(self.extra_trans_entry, ', '.join(
+            img.get('trans', trans) for img in datos_imgs))
+
+    def get_extra_trans(self):
+        """Gets the transitions of the extra images.
+
+        Returns:
+            list: transition number (str) of each extra image.
+        """
+        return [trans.strip() for trans in self.extra_trans_entry.get().split(',')
+                if len(trans.strip()) > 0]
+
     def new_mol_set(self, mol):
-        """Function called when a new molecule is selected.
+        """Function called when a new molecule is selected. Its information is got in background and
+        shown by mol_set.
+
+        Args:
+            mol (str): molecule name
+        """
+        self.controller.request_mol(mol, partial(self.mol_set, mol))
+
+    def mol_set(self, mol, chosen_mol_dic):
+        """Shows the information of the selected molecule.
 
         Args:
             mol (str): molecule name
+            chosen_mol_dic (dict): molecule information from Controller update_mol (or None if it is
+                the same molecule as before).
         """
-        self.chosen_mol_dic = self.controller.update_mol(mol)
+        self.chosen_mol_dic = chosen_mol_dic
         if self.chosen_mol_dic is not None:
             old_mol = self.chosen_mol_dic['old_mol']
             if len(old_mol) == 0 or old_mol != mol:  # if it is not the same molecule as before
                 # We change nummber of possible transitions accordingly
-                self.spinbox_len = len(
-                    self.chosen_mol_dic['radtransitions'])
+                self.index_transitions(self.chosen_mol_dic['radtransitions'])
+                self.spinbox_len = len(self.trans_rows)
                 self.trans_spinbox.config(to=self.spinbox_len)
                 self.trans_spinbox["state"] = "enabled"
                 old_trans = self.trans_val.get()
@@ -956,16 +1065,25 @@ class View(ttk.Frame):
                     mol_name, width=45, break_long_words=False))
                 self.mol_name.config(text=wrapped_mol_name)
 
-    def restore_tree(self, tree, data):
-        """Updates tree with data (cleaning previous one).
+    def show_tree_items(self, tree, items):
+        """Shows only some of the existing tree rows, in order. The rest are detached (not deleted),
+        and if the shown rows are narrowed down only the removed ones are detached.
 
         Args:
             tree (tk.Tree).
-            data (list): data to populate tree.
+            items (list): ids of the rows to show.
         """
-        tree.delete(*tree.get_children())
-        for item in data:
-            tree.insert('', tk.END, item, values=item)
+        shown = tree.get_children('')
+        keep = set(items)
+        if keep.issubset(shown):
+            removed = [item for item in shown if item not in keep]
+            if len(removed) > 0:
+                tree.detach(*removed)
+        else:
+            if len(shown) > 0:
+                tree.detach(*shown)
+            for index, item in enumerate(items):
+                tree.reattach(item, '', index)
 
     def search_mol(self, event):
         """Callback when molecule is searched.
@@ -973,41 +1091,49 @@ class View(ttk.Frame):
         Args:
             event (_type_): _description_
         """
-        val = event.widget.get()
-        if val == '':
-            data = self.mol_list
-        else:
-            data = []
-            for item in self.mol_list:
-                if val.lower() in item.lower():
-                    data.append(item)
-
-        self.restore_tree(self.mol_tree, data)
+        data = self.mol_index.search(event.widget.get())
+        self.show_tree_items(self.mol_tree, data)
 
         mol_name = self.controller.get_mol_name()
-
         if mol_name in data:
-            for child in self.mol_tree.get_children():
-                if self.mol_tree.item(child)["values"][0] == mol_name:
-                    idx = child
-                    break
-            self.mol_tree.selection_set(idx)
+            self.mol_tree.selection_set(mol_name)
 
     def trans_changed_event(self, event):
         if self.trans_spinbox.get() != '':
             self.trans_changed()
 
+    def index_transitions(self, trans_table):
+        """Converts the transitions table of the chosen molecule to rows indexed by transition
+        number, so changing the transition does not search the table.
+
+        Args:
+            trans_table (astropy.table.Table): radiative transitions table.
+        """
+        columns = [trans_table[c].tolist() for c in trans_table.colnames]
+        self.trans_rows = list(zip(*columns))
+        self.trans_pos = {int(number): pos for pos,
+                          number in enumerate(trans_table['Transition'].tolist())}
+
     def trans_changed(self):
-        """When transition is changed it will print out the new transition information.
+        """When transition is changed it will print out the new transition information, along with
+        the transitions around it. Only those rows exist in the table, and they are reused.
         """
         trans_number = int(self.trans_spinbox.get())
-        trans_table = self.chosen_mol_dic['radtransitions']
-        if len(trans_table) > 0 and trans_number <= self.spinbox_len:
-            #headings = trans_table.colnames
-            for item in self.mol_info.get_children():
-                self.mol_info.delete(item)
-            self.mol_info.insert(parent='', index='end', iid=0, text='', values=list(
-                trans_table[trans_table['Transition'] == trans_number][0]))
+        if trans_number in self.trans_pos and trans_number <= self.spinbox_len:
+            pos = self.trans_pos[trans_number]
+            first = max(min(pos - self.trans_preview_rows // 2,
+                            len(self.trans_rows) - self.trans_preview_rows), 0)
+            rows = self.trans_rows[first:first + self.trans_preview_rows]
+
+            shown = self.mol_info.get_children()
+            for k, row in enumerate(rows):
+                if k < len(shown):
+                    self.mol_info.item(shown[k], values=row)
+                else:
+                    self.mol_info.insert(parent='', index='end', iid=k, text='', values=row)
+            if len(shown) > len(rows):
+                self.mol_info.delete(*shown[len(rows):])
+            self.mol_info.selection_set(self.mol_info.get_children()[pos - first])
 
     ''' ---------- '''
     ''' Validators '''
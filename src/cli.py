@@ -0,0 +1,53 @@
+# IDEATE without GUI, for batch and cluster execution. It loads the parameters saved in a .bak file
+# (Save parameters button, or written next to the .fits file by Start!) and runs LIME with them.
+# Usage: python src/cli.py <bak file> [--check] [--detach]
+# It must not import anything from the GUI (tkinter), so it can run without a display.
+
+import argparse
+from pathlib import Path
+import sys
+
+from jobs import DONE
+from Model import Model
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs LIME with the IDEATE parameters saved in a .bak file.')
+    parser.add_argument('bak_file', help='.bak file with the model parameters')
+    parser.add_argument('--check', action='store_true',
+                        help='only checks the parameters and scans the shape file data')
+    parser.add_argument('--detach', action='store_true',
+                        help="starts LIME and exits without waiting for it")
+    args = parser.parse_args()
+
+    model = Model()
+    try:
+        if not Path(args.bak_file).is_file():
+            raise Exception("File " + args.bak_file + " not found!")
+        model.load(args.bak_file)
+        model.create_config(check_flag=True)
+        if args.check:
+            model.check_shape(scan=True, workers=None)
+            print('Parameters are correct.')
+            return 0
+        job = model.start()
+    except Exception as err:
+        print('Error: ' + str(err), file=sys.stderr)
+        return 2
+
+    print('LIME job ' + str(job.job_id) + ' (' + job.name + '): ' + job.status +
+          ', working folder ' + str(job.run_dir))
+    if args.detach:  # the job runs in its own session, it goes on after this process ends
+        return 0
+
+    try:
+        model.jobs.wait(job.job_id)
+    except KeyboardInterrupt:
+        model.jobs.cancel(job.job_id)
+    print('LIME job ' + str(job.job_id) + ' ' + job.status + ', output in ' + str(job.stdout_path))
+    return 0 if job.status == DONE else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
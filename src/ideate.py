@@ -1,10 +1,52 @@
-import tkinter as tk
+import sys
+import time
 
-from Model import *
-from View import *
-from Controller import *
+START_TIME = time.perf_counter()
 
-import sv_ttk
+# Seconds until the window is shown. Run with --startup-report to see where the time goes.
+STARTUP_BUDGET = 1.0
+
+# Heavy packages (NumPy, pandas, astropy, astroquery...) are imported by Model, model_utils and
+# mol_cache only when they are needed (a molecule is chosen or Start is clicked), not here.
+startup_times = []   # [(step, seconds)]
+
+
+def timed(step, function, *args):
+    """Runs a startup step, recording how long it takes.
+
+    Args:
+        step (str): step name.
+        function (function): function to run.
+
+    Returns:
+        object: what function returns.
+    """
+    t = time.perf_counter()
+    result = function(*args)
+    startup_times.append((step, time.perf_counter() - t))
+    return result
+
+
+def import_gui():
+    import tkinter as tk
+    return tk
+
+
+def import_app():
+    from Model import Model
+    from View import View
+    from Controller import Controller
+    return Model, View, Controller
+
+
+def import_theme():
+    import sv_ttk
+    return sv_ttk
+
+
+tk = timed('tkinter', import_gui)
+Model, View, Controller = timed('Model, View, Controller', import_app)
+sv_ttk = timed('sv_ttk', import_theme)
 
 
 class App(tk.Tk):
@@ -19,18 +61,35 @@ class App(tk.Tk):
 
         self.title('IDEATE')
 
-        model = Model()
+        model = timed('Model()', Model)
         controller = Controller(model=model)
-        view = View(self, controller)
+        view = timed('View()', View, self, controller)
         view.pack()
 
         controller.set_view(view)
 
 
-app = App()
+def startup_report():
+    """Prints the time spent on each startup step and warns if the window took longer than
+    STARTUP_BUDGET to be shown (always printed if --startup-report is an argument).
+    """
+    total = time.perf_counter() - START_TIME
+    if total > STARTUP_BUDGET or '--startup-report' in sys.argv:
+        print('Startup: ' + '{:.3f}'.format(total) + ' s (budget ' + str(STARTUP_BUDGET) + ' s)')
+        for step, seconds in startup_times:
+            print('  ' + step + ': ' + '{:.3f}'.format(seconds) + ' s')
+
+
+def main():
+    app = timed('App()', App)
+
+    app.tk.call('tk', 'scaling', 3.0)
+    timed('theme', sv_ttk.set_theme, "light")  # Set light theme
+    # sv_ttk.set_theme("dark")  # Set dark theme
+
+    app.after_idle(startup_report)  # when the window is drawn
+    app.mainloop()
 
-app.tk.call('tk', 'scaling', 3.0)
-sv_ttk.set_theme("light")  # Set light theme
-# sv_ttk.set_theme("dark")  # Set dark theme
 
-app.mainloop()
+if __name__ == '__main__':
+    main()
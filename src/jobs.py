@@ -0,0 +1,272 @@
+import os
+from pathlib import Path
+import shutil
+import signal
+import subprocess as sub
+import tempfile
+import time
+
+# Job status values.
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+ACTIVE = (QUEUED, RUNNING)
+
+# Files needed to run LIME model (lime_model.py imports shape_data.py).
+MODEL_FILES = ["lime_model.py", "shape_data.py"]
+
+
+def lime_command(lime_path=None):
+    """Shell command running LIME model of a job working folder (see Job), with its config file.
+
+    Args:
+        lime_path (Path, optional): LIME folder, None if pylime is already a command. Defaults to None.
+
+    Returns:
+        str: shell command.
+    """
+    command = 'IDEATE_CONFIG="$IDEATE_RUN_DIR/lime_config.ini" pylime lime_model.py'
+    if lime_path is None:
+        return command
+    return 'cd ' + str(lime_path) + ' ; . ./pylimerc.sh ; cd "$IDEATE_RUN_DIR" ; ' + command
+
+
+class Job:
+    """A LIME run (a shell command) managed by JobManager. It runs in its own working folder,
+    where its files are written when it starts (e.g. config file and model) and its output and
+    errors are saved (stdout.log and stderr.log). The folder path is in the IDEATE_RUN_DIR
+    environment variable of the command.
+    """
+
+    def __init__(self, job_id, name, command, run_dir, files=None, copy_files=None, key=None) -> None:
+        """
+        Args:
+            job_id (int): job number.
+            name (str): name shown to the user.
+            command (str): shell command.
+            run_dir (Path): job working folder.
+            files (dict, optional): {file name: text} files written in run_dir just before the command starts. Defaults to None.
+            copy_files (list, optional): paths of files copied to run_dir just before the command starts. Defaults to None.
+            key (str, optional): identifies the job, two active jobs cannot have the same one. Defaults to None.
+        """
+        self.job_id = job_id
+        self.name = name
+        self.command = command
+        self.run_dir = Path(run_dir)
+        self.files = files if files is not None else {}
+        self.copy_files = copy_files if copy_files is not None else []
+        self.key = key
+
+        self.status = QUEUED
+        self.returncode = None
+        self.process = None
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def stdout_path(self):
+        return self.run_dir / 'stdout.log'
+
+    @property
+    def stderr_path(self):
+        return self.run_dir / 'stderr.log'
+
+    def info(self):
+        """Job status information.
+
+        Returns:
+            dict: {'id', 'name', 'status', 'returncode', 'submit_time', 'start_time', 'end_time',
+                'run_dir', 'stdout', 'stderr'}.
+        """
+        return {'id': self.job_id, 'name': self.name, 'status': self.status,
+                'returncode': self.returncode, 'submit_time': self.submit_time,
+                'start_time': self.start_time, 'end_time': self.end_time,
+                'run_dir': str(self.run_dir), 'stdout': str(self.stdout_path),
+                'stderr': str(self.stderr_path)}
+
+
+class JobManager:
+    """Runs LIME jobs as subprocesses, at most max_running at the same time (the rest wait in a
+    queue, in order). Jobs are updated when poll is called, so whoever uses it must call poll
+    regularly (e.g. from the GUI event loop) while there are active jobs.
+    """
+
+    def __init__(self, jobs_dir, max_running=1) -> None:
+        """
+        Args:
+            jobs_dir (Path): folder where each job gets its working folder (named after its submission time and number).
+            max_running (int, optional): maximum number of jobs running at the same time. Defaults to 1.
+        """
+        self.jobs_dir = Path(jobs_dir)
+        self.max_running = max(int(max_running), 1)
+        self.job_list = []
+        self.next_id = 1
+
+    def submit(self, name, command, files=None, copy_files=None, key=None):
+        """Adds a job to the queue and starts it if possible. The job runs in its own working
+        folder inside jobs_dir.
+
+        Args:
+            name (str): name shown to the user.
+            command (str): shell command.
+            files (dict, optional): {file name: text} files written in the job folder just before the command starts. Defaults to None.
+            copy_files (list, optional): paths of files copied to the job folder just before the command starts. Defaults to None.
+            key (str, optional): identifies the job, two active jobs cannot have the same one. Defaults to None.
+
+        Raises:
+            Exception: if an active job has the same key.
+
+        Returns:
+            Job: the new job.
+        """
+        self.poll()
+        if key is not None and any(job.key == key for job in self.active()):
+            raise Exception("This model is already running or waiting to run!")
+
+        job_id = self.next_id
+        self.next_id += 1
+        # Unique folder, also among several IDEATE sessions sharing jobs_dir
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        run_dir = tempfile.mkdtemp(prefix=time.strftime('%Y%m%d-%H%M%S-') + str(job_id) + '-',
+                                   dir=str(self.jobs_dir))
+        job = Job(job_id, name, command, run_dir, files, copy_files, key)
+        self.job_list.append(job)
+        self.poll()
+        return job
+
+    def poll(self):
+        """Updates running jobs and starts queued ones while there are free slots.
+        """
+        for job in self.job_list:
+            if job.status == RUNNING:
+                returncode = job.process.poll()
+                if returncode is not None:
+                    self._finish(job, DONE if returncode == 0 else FAILED, returncode)
+            elif job.status == CANCELLED and job.process is not None and job.returncode is None:
+                job.returncode = job.process.poll()  # reaped once it ends after cancel
+
+        n_running = sum(job.status == RUNNING for job in self.job_list)
+        for job in self.job_list:
+            if n_running >= self.max_running:
+                break
+            if job.status == QUEUED:
+                try:
+                    self._launch(job)
+                except Exception as err:  # e.g. files cannot be written, it is not tried again
+                    self._fail_launch(job, err)
+                    continue
+                n_running += 1
+
+    def cancel(self, job_id):
+        """Cancels a job: it is removed from the queue or its process is terminated (without
+        waiting for it, its return code is set by a later poll).
+
+        Args:
+            job_id (int): job number.
+        """
+        self._cancel(self.get(job_id))
+        self.poll()
+
+    def cancel_all(self):
+        """Cancels all the active jobs. Queued jobs are cancelled first, so none of them is started
+        when the running ones are terminated.
+        """
+        for job in self.active():
+            if job.status == QUEUED:
+                self._cancel(job)
+        for job in self.active():
+            self._cancel(job)
+        self.poll()
+
+    def get(self, job_id):
+        """Gets a job by its number.
+
+        Args:
+            job_id (int): job number.
+
+        Raises:
+            Exception: if there is no job with that number.
+
+        Returns:
+            Job
+        """
+        for job in self.job_list:
+            if job.job_id == job_id:
+                return job
+        raise Exception("There is no job " + str(job_id) + "!")
+
+    def jobs(self):
+        """All jobs, updated.
+
+        Returns:
+            list: Job objects, in submission order.
+        """
+        self.poll()
+        return list(self.job_list)
+
+    def active(self):
+        """Queued and running jobs (not updated, see poll).
+
+        Returns:
+            list: Job objects, in submission order.
+        """
+        return [job for job in self.job_list if job.status in ACTIVE]
+
+    def wait(self, job_id=None, interval=1.0):
+        """Waits until a job (or all of them) finishes, running the queued ones meanwhile.
+
+        Args:
+            job_id (int, optional): job number. Defaults to None (all jobs).
+            interval (float, optional): seconds between polls. Defaults to 1.0.
+        """
+        self.poll()
+        while any(job.status in ACTIVE for job in self.job_list
+                  if job_id is None or job.job_id == job_id):
+            time.sleep(interval)
+            self.poll()
+
+    def _cancel(self, job):
+        if job.status == QUEUED:
+            self._finish(job, CANCELLED, None)
+        elif job.status == RUNNING:
+            try:
+                if hasattr(os, 'killpg'):  # the shell and LIME processes
+                    os.killpg(job.process.pid, signal.SIGTERM)
+                else:
+                    job.process.terminate()
+            except ProcessLookupError:
+                pass
+            self._finish(job, CANCELLED, job.process.poll())
+
+    def _launch(self, job):
+        job.run_dir.mkdir(parents=True, exist_ok=True)
+        for name, text in job.files.items():
+            with open(job.run_dir / name, 'w') as f:
+                f.write(text)
+        for path in job.copy_files:
+            shutil.copyfile(path, job.run_dir / Path(path).name)
+
+        env = dict(os.environ, IDEATE_RUN_DIR=str(job.run_dir))
+        with open(job.stdout_path, 'w') as out, open(job.stderr_path, 'w') as err:
+            # Own session, so cancel can terminate the shell and everything it started
+            job.process = sub.Popen(job.command, shell=True, cwd=str(job.run_dir), env=env,
+                                    stdout=out, stderr=err, start_new_session=True)
+        job.status = RUNNING
+        job.start_time = time.time()
+
+    def _fail_launch(self, job, err):
+        try:
+            with open(job.stderr_path, 'a') as f:
+                f.write('Job could not be started: ' + str(err) + '\n')
+        except (IOError, OSError):
+            pass
+        self._finish(job, FAILED, None)
+
+    def _finish(self, job, status, returncode):
+        job.status = status
+        job.returncode = returncode
+        job.end_time = time.time()
@@ -11,17 +11,22 @@
 from limepar_classes import *
 
 import numpy
-import pandas as pd
 from scipy.spatial import KDTree
 
 import errno
 import os
 import configparser
-import re as reg
+from collections import namedtuple
+
+from shape_data import (CACHE_DIR, COORDS, Occupancy, ShapeCache, Triangulation,
+                        build_lattice, fork_pool, max_spacing)
 
-from sympy import *
 import math
-from py_expression_eval import Parser
+import multiprocessing
+import threading
+from functools import reduce
+from io import BytesIO
+from py_expression_eval import Parser, TNUMBER, TOP1, TOP2, TVAR, TFUNCALL
 
 # Units conversion dictionary (same as macros, but with some units added)
 uds_dict = {
@@ -52,19 +57,17 @@ uds_dict = {
 # Auxiliar functions
 
 
-def max_dist_ordered_pts(pts_list):
+def uds_factor(uds):
     """
-    max_dist_ordered_pts gives the maximum distance from a list of ordered points.
+    uds_factor gives the conversion factor to SI of a unit string, which can be a quotient (e.g. km/s).
 
-    :param pts_list: list of ordered points.
-    :return: maximum distance between points in the list.
+    :param uds: unit string, a key of uds_dict or two of them joined by '/'.
+    :return: conversion factor.
     """
-    max_dist = 0
-    for i in range(len(pts_list)-1):
-        dist = abs(pts_list[i+1] - pts_list[i])
-        if dist > max_dist:
-            max_dist = dist
-    return max_dist
+    if uds in uds_dict:  # some units include '/' (e.g. #/cm^3)
+        return uds_dict[uds]
+    uds_list = uds.split('/')
+    return uds_dict[uds_list[0]] / uds_dict[uds_list[1]]
 
 
 def get_radius(x, y, z):
@@ -86,6 +89,132 @@ def get_radius(x, y, z):
     return r
 
 
+# Parser to evaluate analytic functions
+parser = Parser()
+
+
+# NumPy versions of py-expression-eval operators and functions, to evaluate analytic functions on
+# arrays of radius. The rest (random, fac...) have no NumPy version and are evaluated point by point.
+VECTOR_OPS1 = {
+    'sin': numpy.sin, 'cos': numpy.cos, 'tan': numpy.tan,
+    'asin': numpy.arcsin, 'acos': numpy.arccos, 'atan': numpy.arctan,
+    'sind': lambda a: numpy.sin(numpy.radians(a)),
+    'cosd': lambda a: numpy.cos(numpy.radians(a)),
+    'tand': lambda a: numpy.tan(numpy.radians(a)),
+    'asind': lambda a: numpy.degrees(numpy.arcsin(a)),
+    'acosd': lambda a: numpy.degrees(numpy.arccos(a)),
+    'atand': lambda a: numpy.degrees(numpy.arctan(a)),
+    'sqrt': numpy.sqrt, 'abs': numpy.abs, 'ceil': numpy.ceil, 'floor': numpy.floor,
+    'round': numpy.round, '-': numpy.negative, 'not': numpy.logical_not, 'exp': numpy.exp
+}
+VECTOR_OPS2 = {
+    '^': numpy.power, '**': numpy.power,
+    'and': numpy.logical_and, 'or': numpy.logical_or, 'xor': numpy.logical_xor
+}
+VECTOR_FUNCTIONS = {
+    'log': lambda a, b=None: numpy.log(a) if b is None else numpy.log(a) / numpy.log(b),
+    'min': lambda *args: reduce(numpy.minimum, args),
+    'max': lambda *args: reduce(numpy.maximum, args),
+    'pyt': numpy.hypot, 'pow': numpy.power, 'atan2': numpy.arctan2, 'if': numpy.where
+}
+
+
+def compile_func(func, name, vector=False):
+    """compile_func parses an analytic function of r once and turns it into a Python callable.
+    It supports the same operators, constants and functions as py-expression-eval, as it uses
+    the ones from the parsed expression, but the expression is not tokenized again on every call.
+    The scalar callable has a vector attribute with the same function compiled for NumPy arrays.
+
+    :param func: analytic function string (py-expression-eval syntax, only variable r).
+    :param name: name of the function, used in the error messages.
+    :param vector: if True, only the version for NumPy arrays of r is returned.
+    :return: callable f(r).
+    """
+    try:
+        expr = parser.parse(func)
+    except Exception as err:
+        raise Exception(name + ' could not be parsed (' + str(err) + '): ' + func)
+
+    ops1 = expr.ops1
+    ops2 = expr.ops2
+    functions = expr.functions
+    if vector:
+        ops1 = dict(ops1, **VECTOR_OPS1)
+        ops2 = dict(ops2, **VECTOR_OPS2)
+        functions = dict(functions, **VECTOR_FUNCTIONS)
+
+    # The expression is stored in reverse polish notation, so each token becomes a closure
+    # over the closures of its operands.
+    stack = []
+    for item in expr.tokens:
+        if item.type_ == TNUMBER:
+            stack.append(_compile_const(item.number_))
+        elif item.type_ == TVAR:
+            if item.index_ == 'r':
+                stack.append(_compile_r())
+            elif item.index_ in functions:
+                stack.append(_compile_const(functions[item.index_]))
+            else:
+                raise Exception(name + ' uses an undefined variable (' +
+                                str(item.index_) + '), only r is allowed: ' + func)
+        elif item.type_ == TOP1 and len(stack) >= 1:
+            stack.append(_compile_op1(ops1[item.index_], stack.pop()))
+        elif item.type_ == TOP2 and len(stack) >= 2:
+            f2 = stack.pop()
+            f1 = stack.pop()
+            stack.append(_compile_op2(ops2[item.index_], f1, f2))
+        elif item.type_ == TFUNCALL and len(stack) >= 2:
+            f_args = stack.pop()
+            f_func = stack.pop()
+            stack.append(_compile_call(f_func, f_args))
+        else:
+            raise Exception(name + ' is not a valid expression: ' + func)
+
+    if len(stack) != 1:
+        raise Exception(name + ' is not a valid expression: ' + func)
+    if vector:
+        return stack[0]
+
+    scalar_func = stack[0]
+    vector_func = compile_func(func, name, vector=True)
+    scalar_func.vector = lambda r: _vector_call(scalar_func, vector_func, r)
+    return scalar_func
+
+
+def _compile_const(val):
+    return lambda r: val
+
+
+def _compile_r():
+    return lambda r: r
+
+
+def _compile_op1(op, f):
+    return lambda r: op(f(r))
+
+
+def _compile_op2(op, f1, f2):
+    return lambda r: op(f1(r), f2(r))
+
+
+def _vector_call(scalar_func, vector_func, r):
+    try:
+        val = vector_func(r)
+    except Exception:  # operators without NumPy version, point by point
+        val = numpy.frompyfunc(scalar_func, 1, 1)(r)
+    return numpy.zeros_like(r) + numpy.asarray(val, dtype=numpy.float64)  # constants to arrays
+
+
+def _compile_call(f_func, f_args):
+    def call(r):
+        args = f_args(r)
+        if type(args) is list:  # several arguments joined by the ',' operator
+            return f_func(r)(*args)
+        return f_func(r)(args)
+    return call
+
+
+
 ''' TODO: Spherical conversion, not implemented.
 # make sure which units + which convention for  theta, phi, and x,y,z
 # *pi/180 to radians, at themoment spherical: (radial, azimuthal [0,2pi), polar [0,pi])
@@ -103,75 +232,496 @@ def cart2sph(x, y, z):  # line of vision, derecha, arriba
 '''
 
 
-# Reading config ini file
+# Reading config ini file: its path is in IDEATE_CONFIG environment variable (set by IDEATE for
+# each run), else lime_config.ini in the current folder.
+config_path = os.environ.get('IDEATE_CONFIG', 'lime_config.ini')
 config = configparser.ConfigParser()
 try:
-    with open('lime_config.ini') as f:
+    with open(config_path) as f:
         config.read_file(f)
 except IOError:
-    raise Exception('Config file not found. It should be named lime_config.ini and placed in the same folder as the model.')
+    raise Exception('Config file ' + config_path + ' not found. Its path can be given in IDEATE_CONFIG environment variable, else it should be named lime_config.ini and placed in the current folder.')
 
 shape_file = config['PARS']['shape_file']
 
-# Reading shape tabulated data file
-df = pd.read_csv(shape_file, sep='\t')
-for c in df.columns:
-    if reg.match("Unnamed*", c):
-        del df[c]
-df = df.dropna(subset=['Px', 'Py', 'Pz'])
-df = df.reset_index()
-
-# Units conversion for data from the file
-xyzr_uds = config['UDS']['xyzr']
-df['Px'] *= uds_dict[xyzr_uds]
-df['Py'] *= uds_dict[xyzr_uds]
-df['Pz'] *= uds_dict[xyzr_uds]
-
-if 'density' in config['VARS'] and config.getboolean('VARS', 'density') is True:
-    df['Density'] *= uds_dict[config['UDS']['density']]
-
-if 'velocity' in config['VARS'] and config.getboolean('VARS', 'velocity') is True:
-    vel_uds = (config['UDS']['velocity']).split('/')
-    df['Vx'] *= uds_dict[vel_uds[0]] / uds_dict[vel_uds[1]]
-    df['Vy'] *= uds_dict[vel_uds[0]] / uds_dict[vel_uds[1]]
-    df['Vz'] *= uds_dict[vel_uds[0]] / uds_dict[vel_uds[1]]
-
-if 'temperature' in config['VARS'] and config.getboolean('VARS', 'temperature') is True:
-    df['Temperature'] *= uds_dict[config['UDS']['temperature']]
-
-if 'turbulence' in config['VARS'] and config.getboolean('VARS', 'turbulence') is True:
-    vel_uds = (config['UDS']['turbulence']).split('/')
-    df['Turbulence'] *= uds_dict[vel_uds[0]] / uds_dict[vel_uds[1]]
-
-# Calculate max distance between points in shape grid
-lpz = list(set(df['Pz']))
-lpz.sort()
-lpx = list(set(df['Px']))
-lpx.sort()
-lpy = list(set(df['Py']))
-lpy.sort()
-
-max_dist = math.sqrt(max_dist_ordered_pts(lpx)**2+max_dist_ordered_pts(lpy)
-                     ** 2+max_dist_ordered_pts(lpz)**2) + 0.1*uds_dict['AU']
-
-# Ini parser to evaluate analytic functions
-parser = Parser()
+# Run plan: everything the callbacks need from the config file, resolved only once.
+# Each quantity says if it is read from the file (from_file), the compiled analytic function
+# used otherwise (func, None if there is none), the factor to convert it to SI units and its
+# value (in SI units) where the tabulated data cannot be interpolated (fill).
+QuantityPlan = namedtuple('QuantityPlan', ['from_file', 'func', 'factor', 'fill'])
+RunPlan = namedtuple('RunPlan', ['density', 'temperature', 'turbulence',
+                                 'velocity', 'abundance', 'xyzr_factor', 'interpolation'])
 
-# Ini kdtree to find nearest points
-npdf = df[['Px', 'Py', 'Pz']].to_numpy()
-kdtree = KDTree(npdf)
+# Interpolation modes for the tabulated data: value of the nearest point, trilinear interpolation
+# on the shape grid (it needs a regular or rectilinear grid) or linear interpolation on the Delaunay
+# triangulation of the points (for scattered data).
+INTERPOLATIONS = ['nearest', 'trilinear', 'linear']
 
-''' Option 2: using LinearNDInterpolator instead of KDtree. Problem: which fill value for velocity?
-from scipy.interpolate import LinearNDInterpolator
+# Default fill values (SI units) outside of the triangulation in linear mode. They can be changed
+# in the FILL section of the config file.
+FILL_VALUES = {'density': 1e3, 'temperature': 0.0,
+               'turbulence': 0.0, 'velocity': 0.0}
+
+
+def quantity_plan(var, func_key, uds_key):
+    """
+    quantity_plan resolves how a quantity is obtained from the config file.
+
+    :param var: key of the variable in VARS section.
+    :param func_key: key of its analytic function in FUNCS section.
+    :param uds_key: key of its units in UDS section.
+    :return: QuantityPlan.
+    """
+    factor = uds_factor(config['UDS'][uds_key])
+    if var in config['VARS'] and config.getboolean('VARS', var) is True:
+        fill = FILL_VALUES[var]
+        if 'FILL' in config and var in config['FILL']:
+            fill = float(config['FILL'][var])
+        return QuantityPlan(True, None, factor, fill)
+    return QuantityPlan(False, compile_func(config['FUNCS'][func_key], func_key), factor, None)
+
+
+def build_plan():
+    """
+    build_plan creates the run plan from the config file. Analytic functions are compiled here,
+    so a wrong expression fails before LIME starts.
+
+    :return: RunPlan.
+    """
+    if config.getboolean('VARS', 'velocity') is False and config['FUNCS']['vel_direction'] != 'radial':
+        # TODO: other vector fields, not implemented (velocity will be 0)
+        vel_plan = QuantityPlan(False, None, uds_factor(config['UDS']['velocity']), None)
+    else:
+        vel_plan = quantity_plan('velocity', 'vel_func', 'velocity')
+
+    if 'rel_abundance_func' in config['MOL']:
+        abun_plan = QuantityPlan(False, compile_func(
+            config['MOL']['rel_abundance_func'], 'rel_abundance_func'), 1, None)
+    else:
+        raise Exception('rel_abundance_func was not specified')
+
+    interpolation = config['PARS'].get('interpolation', 'nearest')
+    if interpolation not in INTERPOLATIONS:
+        raise Exception('interpolation must be one of: ' + ', '.join(INTERPOLATIONS))
+
+    return RunPlan(density=quantity_plan('density', 'dens_func', 'density'),
+                   temperature=quantity_plan(
+                       'temperature', 'temp_func', 'temperature'),
+                   turbulence=quantity_plan(
+                       'turbulence', 'turb_func', 'turbulence'),
+                   velocity=vel_plan,
+                   abundance=abun_plan,
+                   xyzr_factor=uds_dict[config['UDS']['xyzr']],
+                   interpolation=interpolation)
+
+
+plan = build_plan()
+
+# Columnar store of the shape data: one contiguous array per physical field, already in SI units,
+# so callbacks only do integer indexing. Fields not read from the file are None.
+ShapeData = namedtuple('ShapeData', ['coords', 'density', 'temperature',
+                                     'turbulence', 'velocity'])
+
+
+def load_shape(shape_file):
+    """
+    load_shape gets the shape tabulated data with the read variables converted to SI units. Data is
+    read from the shape cache if this file was already preprocessed with the same units.
+
+    :param shape_file: path to the shape tabulated data file.
+    :return: ShapeData and its ShapeCache.
+    """
+    fields = {'coords': (COORDS, plan.xyzr_factor)}
+    if plan.density.from_file:
+        fields['density'] = ('Density', plan.density.factor)
+    if plan.temperature.from_file:
+        fields['temperature'] = ('Temperature', plan.temperature.factor)
+    if plan.turbulence.from_file:
+        fields['turbulence'] = ('Turbulence', plan.turbulence.factor)
+    if plan.velocity.from_file:
+        fields['velocity'] = (['Vx', 'Vy', 'Vz'], plan.velocity.factor)
+
+    cache = ShapeCache(shape_file, fields, config['PARS'].get('cache_dir', CACHE_DIR))
+    arrays = cache.arrays()
+    return ShapeData(coords=arrays['coords'],
+                     density=arrays.get('density'),
+                     temperature=arrays.get('temperature'),
+                     turbulence=arrays.get('turbulence'),
+                     velocity=arrays.get('velocity')), cache
 
-x = df['Px']
-y = df['Py']
-z = df['Pz']
-dens_interpol = LinearNDInterpolator((x,y,z), df['Density'], fill_value=1e3)
-vx_interpol = LinearNDInterpolator((x,y,z), df['Vx'], fill_value=0) #TODO only if read
-vy_interpol = LinearNDInterpolator((x,y,z), df['Vy'], fill_value=0) #TODO only if read 
-vz_interpol = LinearNDInterpolator((x,y,z), df['Vz'], fill_value=0) #TODO only if read
-'''
+
+shape, shape_cache = load_shape(shape_file)
+
+# Statistics of the shape file (saved with the shape cache and shared with the GUI check, in the
+# units of the file), to get the max distance between its points
+stats = shape_cache.stats()
+
+max_dist = max_spacing(stats) * plan.xyzr_factor + 0.1*uds_dict['AU']
+
+# Ini structures to find nearest points (stored in the shape cache). ShapeX grids are usually a
+# regular lattice, where the nearest point is found by index arithmetic. The KD-tree is only loaded
+# for scattered data or points whose nearest lattice node is empty.
+lattice = shape_cache.get('lattice', lambda: build_lattice(shape.coords, stats))
+if plan.interpolation == 'trilinear' and lattice is None:
+    raise Exception('trilinear interpolation needs the shape points to be on a regular or rectilinear grid, use linear interpolation instead')
+
+# Occupancy bitmap to reject points far from the modelled structure without searching the nearest
+# point (stored in the shape cache)
+occupancy = shape_cache.get('occupancy', lambda: Occupancy(shape.coords, max_dist))
+
+# Delaunay triangulation for linear interpolation (stored in the shape cache)
+triangulation = None
+if plan.interpolation == 'linear':
+    triangulation = shape_cache.get(
+        'delaunay', lambda: Triangulation(shape.coords))
+
+
+def load_kdtree():
+    return shape_cache.get('kdtree', lambda: KDTree(shape.coords))
+
+
+class PointResolver(object):
+    """
+    PointResolver resolves the grid point LIME is asking for only once. LIME calls density, temperature,
+    abundance, doppler and velocity one after the other for the same (x,y,z), so the nearest
+    tabulated point and the radius are computed the first time they are needed and reused by
+    the rest of the callbacks until a different point is asked. The present point is kept per
+    thread, because LIME may call the callbacks from several threads (nthreads).
+    """
+
+    def __init__(self, tree_loader, occupancy, lattice=None, interpolation='nearest', triangulation=None):
+        """
+        :param tree_loader: function without arguments returning the KDTree built with the
+            tabulated points coordinates. It is only called if the tree is needed.
+        :param occupancy: Occupancy bitmap of the tabulated points (with max_dist).
+        :param lattice: Lattice of the tabulated points, None if they are scattered.
+        :param interpolation: interpolation mode of the tabulated data (one of INTERPOLATIONS).
+        :param triangulation: Triangulation of the tabulated points, needed for linear interpolation.
+        """
+        self.tree_loader = tree_loader
+        self.tree = None
+        self.tree_lock = threading.Lock()
+        self.occupancy = occupancy
+        self.lattice = lattice
+        self.interpolation = interpolation
+        self.triangulation = triangulation
+        self.local = threading.local()  # present point results of each thread
+
+    def resolve(self, x, y, z):
+        """
+        resolve sets (x,y,z) as the present point of this thread, forgetting previous results if it
+        is a new one.
+
+        :param x: x-coordinate.
+        :param y: y-coordinate.
+        :param z: z-coordinate.
+        :return: itself, to chain nearest() or radius() calls.
+        """
+        p = self.local
+        if getattr(p, 'xyz', None) != (x, y, z):
+            p.xyz = (x, y, z)
+            p.dist = None
+            p.i = None
+            p.r = None
+            p.rows = None
+            p.weights = None
+            p.out = None
+        return self
+
+    def outside(self):
+        """
+        outside checks if the present point is outside of the modelled structure, that is, at
+        max_dist or farther from every tabulated point. Most of the empty space is rejected by the
+        occupancy bitmap, only points near the structure need the nearest point.
+
+        :return: True if the point is outside of the structure.
+        """
+        p = self.local
+        if p.out is None:
+            p.out = not self.occupancy.near(
+                *p.xyz) or self.nearest()[0] >= max_dist
+        return p.out
+
+    def nearest(self):
+        """
+        nearest gets the nearest tabulated point to the present point.
+
+        :return: (distance to the nearest point, index of the nearest point).
+        """
+        p = self.local
+        if p.i is None:
+            found = None
+            if self.lattice is not None:
+                found = self.lattice.nearest(*p.xyz)
+            if found is None:
+                if self.tree is None:
+                    with self.tree_lock:
+                        if self.tree is None:  # it may have been loaded by another thread
+                            self.tree = self.tree_loader()
+                found = self.tree.query(p.xyz)
+            p.dist, p.i = found
+        return p.dist, p.i
+
+    def stencil(self):
+        """
+        stencil gets the tabulated points used to get the values of the present point and their
+        weights.
+
+        :return: (list of row indexes, list of weights). Both lists are empty if the point is
+            outside of the triangulation in linear mode.
+        """
+        p = self.local
+        if p.weights is None:
+            found = None
+            if self.interpolation == 'trilinear':
+                found = self.lattice.trilinear(*p.xyz)
+            elif self.interpolation == 'linear':
+                found = self.triangulation.linear(*p.xyz)
+                if found is None:
+                    found = ([], [])
+            if found is None:  # nearest mode, or outside of the grid
+                found = ([self.nearest()[1]], [1.0])
+            p.rows, p.weights = found
+        return p.rows, p.weights
+
+    def sample(self, arr, fill):
+        """
+        sample gets the value of a tabulated field at the present point.
+
+        :param arr: numpy array with the field values (one row per tabulated point).
+        :param fill: value if the point cannot be interpolated.
+        :return: value (a float, or a row of arr).
+        """
+        rows, weights = self.stencil()
+        if len(rows) == 1:
+            return arr[rows[0]]
+        if len(rows) == 0:
+            return numpy.full(arr.shape[1:], fill) if arr.ndim > 1 else fill
+        return numpy.dot(weights, arr[rows])
+
+    def radius(self):
+        """
+        radius gets the radius of the present point (see get_radius).
+
+        :return: radius to the center.
+        """
+        p = self.local
+        if p.r is None:
+            p.r = get_radius(*p.xyz)
+        return p.r
+
+
+point = PointResolver(load_kdtree, occupancy, lattice,
+                      plan.interpolation, triangulation)
+
+
+# Pregrid: LIME grid points given by the shape points, with all the values evaluated in bulk.
+# Rows of the file: id x y z density temperature abundance turbulence vx vy vz (SI units).
+PREGRID_CHUNK = 200000  # rows evaluated at once (by each worker process)
+PREGRID_FMT = ['%d'] + ['%.9e'] * 10
+
+pregrid_idx = None  # rows of the shape data inside the model radius, set by write_pregrid
+
+
+def pregrid_rows(bounds):
+    """
+    pregrid_rows evaluates all the values of a slice of the pregrid points at once, as the callbacks
+    would do for each of them.
+
+    :param bounds: (first, last) positions in pregrid_idx.
+    :return: text of the pregrid file rows (bytes).
+    """
+    first, last = bounds
+    idx = pregrid_idx[first:last]
+    xyz = shape.coords[idx]
+    r = numpy.maximum(numpy.sqrt((xyz**2).sum(axis=1)),
+                      0.1*uds_dict["AU"]) / plan.xyzr_factor  # as get_radius
+
+    if plan.density.from_file:
+        dens = numpy.maximum(shape.density[idx], 1e3)
+    else:
+        dens = plan.density.func.vector(r) * plan.density.factor
+
+    if plan.temperature.from_file:
+        temp = shape.temperature[idx]
+    else:
+        temp = plan.temperature.func.vector(r) * plan.temperature.factor
+
+    abun = plan.abundance.func.vector(r)
+
+    if plan.turbulence.from_file:
+        turb = shape.turbulence[idx]
+    else:
+        turb = plan.turbulence.func.vector(r) * plan.turbulence.factor
+
+    if plan.velocity.from_file:
+        vel = shape.velocity[idx]
+    elif plan.velocity.func is not None:  # radial, as velocity()
+        vel = xyz * (plan.velocity.func.vector(r) * plan.velocity.factor / r)[:, None]
+    else:
+        vel = numpy.zeros_like(xyz)
+
+    ids = numpy.arange(first, last)
+    table = numpy.column_stack([ids, xyz, dens, temp, abun, turb, vel])
+    buf = BytesIO()
+    numpy.savetxt(buf, table, fmt=PREGRID_FMT)
+    return buf.getvalue()
+
+
+def write_pregrid(path, radius):
+    """
+    write_pregrid writes the LIME pregrid file with the shape points inside the model radius. Big
+    models are split in chunks evaluated by several worker processes (pregrid_workers parameter in
+    PARS section, by default the number of CPUs).
+
+    :param path: pregrid file path.
+    :param radius: model radius (m).
+    :return: number of points written.
+    """
+    global pregrid_idx
+    r = numpy.sqrt((shape.coords**2).sum(axis=1))
+    pregrid_idx = numpy.nonzero(r < radius)[0]
+    n_points = len(pregrid_idx)
+    bounds = [(first, min(first + PREGRID_CHUNK, n_points))
+              for first in range(0, n_points, PREGRID_CHUNK)]
+
+    if 'pregrid_workers' in config['PARS']:
+        workers = int(config['PARS']['pregrid_workers'])
+    else:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(bounds))
+
+    # Workers are forked, so they already have the shape data and the compiled functions
+    pool = fork_pool(workers) if workers > 1 else None
+    tmp_path = path + '.' + str(os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            chunks = pool.imap(pregrid_rows, bounds) if pool is not None else map(pregrid_rows, bounds)
+            for rows in chunks:
+                f.write(rows)
+        os.rename(tmp_path, path)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if os.path.exists(tmp_path):  # not renamed, the pregrid failed
+            os.remove(tmp_path)
+    return n_points
+
+# .......................................................................
+
+
+def image_sections():
+    """
+    Image sections of the config file: IMG and the extra images (IMG.1, IMG.2...), in order.
+
+    :return: list of section names.
+    """
+    extra = [section for section in config.sections()
+             if section.startswith('IMG.') and section[4:].isdigit()]
+    return ['IMG'] + sorted(extra, key=lambda section: int(section[4:]))
+
+
+def image_filename(fits_filepath, section):
+    """
+    Output .fits file of an image: fits_file of its section, or PARS fits_file (with the image
+    number added for the extra images, e.g. model_1.fits).
+
+    :param fits_filepath: PARS fits_file.
+    :param section: image section name.
+    :return: .fits file path.
+    """
+    if section != 'IMG' and 'fits_file' in config[section]:
+        return config[section]['fits_file']
+    if section == 'IMG':
+        return fits_filepath
+    root, ext = os.path.splitext(fits_filepath)
+    return root + '_' + section[4:] + ext
+
+
+def image_parameters(section, filename):
+    """
+    LIME parameters of an image. Extra image sections only need the parameters that change, the
+    rest are taken from IMG section (and the transition from MOL section).
+
+    :param section: image section name.
+    :param filename: output .fits file.
+    :return: ImageParameters.
+    """
+    img_config = dict(config['IMG'])
+    img_config.update(config[section])
+    img = ImageParameters()
+
+    if 'trans' in img_config:
+        # zero-indexed J quantum number
+        img.trans = int(img_config['trans']) - 1
+    elif 'trans' in config['MOL']:
+        img.trans = int(config['MOL']['trans']) - 1
+    else:
+        raise Exception('trans was not specified')
+
+#  img.molI              = -1
+#  img.bandwidth         = -1.0
+
+    if 'nchan' in img_config:
+        img.nchan = int(img_config['nchan'])
+    else:
+        raise Exception('nchan was not specified')
+
+    if 'velres' in img_config:
+        velres_uds = (config['UDS']['velres']).split('/')
+        img.velres = float(img_config['velres']) * \
+            uds_dict[velres_uds[0]] / uds_dict[velres_uds[1]]
+    else:
+        raise Exception('velres was not specified')
+
+    if 'imgres' in img_config:
+        img.imgres = float(img_config['imgres'])
+    else:
+        raise Exception('imgres was not specified')
+
+    if 'pxls' in img_config:
+        img.pxls = int(img_config['pxls'])
+    else:
+        raise Exception('pxls was not specified')
+
+    if 'unit' in img_config:
+        # 0:Kelvin 1:Jansky/pixel 2:SI 3:Lsun/pixel 4:tau
+        img.unit = int(img_config['unit'])
+    else:
+        raise Exception('unit was not specified')
+
+#  img.freq              = -1.0
+
+    if 'vsys' in img_config:
+        vsys_uds = (config['UDS']['vsys']).split('/')
+        img.source_vel = float(img_config['vsys']) * \
+            uds_dict[vsys_uds[0]] / \
+            uds_dict[vsys_uds[1]]  # source velocity in m/s
+#  img.theta             = 0.0
+#  img.phi               = 0.0
+
+    # Orientation, in degrees
+    if 'incl' in img_config:
+        img.incl = math.radians(float(img_config['incl']))
+    if 'posang' in img_config:
+        img.posang = math.radians(float(img_config['posang']))
+    if 'azimuth' in img_config:
+        img.azimuth = math.radians(float(img_config['azimuth']))
+
+    if 'distance' in img_config:
+        img.distance = float(img_config['distance']) * \
+            uds_dict[config['UDS']['distance']]
+    else:
+        raise Exception('distance was not specified')
+
+#  img.doInterpolateVels = False
+
+    img.filename = str(filename)  # Output filename
+
+#  img.units = "0,1"
+
+    return img
 
 # .......................................................................
 
@@ -210,7 +760,10 @@ def input(macros):
 #  par.outputfile        = "populations.pop"
 #  par.binoutputfile     = "restart.pop"
 #    par.gridfile          = "grid.vtk"
-#    par.pregrid           = shape_file
+    if 'pregrid' in config['PARS'] and config.getboolean('PARS', 'pregrid') is True:
+        # Shape points are the grid points, so LIME doesn't need to call back for every point
+        par.pregrid = os.path.abspath('pregrid.dat')
+        par.pIntensity = write_pregrid(par.pregrid, par.radius)
 #  par.restart           = "restart.pop"
 #  par.gridInFile        = "grid_5.ds"
 
@@ -265,6 +818,9 @@ def input(macros):
 #  par.gridDensMaxLoc    = [[0.0,0.0,0.0]] # must be a list, each element of which is also a list with 3 entries (1 for each spatial coordinate).
 
 #  par.tcmb              = 2.72548
+    if 'nthreads' in config['PARS']:
+        par.nThreads = int(config['PARS']['nthreads'])
+
     if 'lte' in config['PARS']:
         # par.lte_only = False by default
         par.lte_only = bool(config['PARS']['lte'])
@@ -288,86 +844,25 @@ def input(macros):
 
 #  par.girdatfile        = ["myGIRs.dat"] # must be a list, even when there is only 1 item.
 
-    # Definitions for image #0. Add further similar blocks for additional images.
-    #
-    # by default this list par.img has 0 entries. Each 'append' will add an entry. The [-1] entry is the most recently added.
-    par.img.append(ImageParameters())
-
-    if 'trans' in config['MOL']:
-        # zero-indexed J quantum number
-        par.img[-1].trans = int(config['MOL']['trans']) - 1
-    else:
-        raise Exception('trans was not specified')
-
-#  par.img[-1].molI              = -1
-#  par.img[-1].bandwidth         = -1.0
-
-    if 'nchan' in config['IMG']:
-        par.img[-1].nchan = int(config['IMG']['nchan'])
-    else:
-        raise Exception('nchan was not specified')
-
-    if 'velres' in config['IMG']:
-        velres_uds = (config['UDS']['velres']).split('/')
-        par.img[-1].velres = float(config['IMG']['velres']) * \
-            uds_dict[velres_uds[0]] / uds_dict[velres_uds[1]]
-    else:
-        raise Exception('velres was not specified')
-
-    if 'imgres' in config['IMG']:
-        par.img[-1].imgres = float(config['IMG']['imgres'])
-    else:
-        raise Exception('imgres was not specified')
-
-    if 'pxls' in config['IMG']:
-        par.img[-1].pxls = int(config['IMG']['pxls'])
-    else:
-        raise Exception('pxls was not specified')
-
-    if 'unit' in config['IMG']:
-        # 0:Kelvin 1:Jansky/pixel 2:SI 3:Lsun/pixel 4:tau
-        par.img[-1].unit = int(config['IMG']['unit'])
-    else:
-        raise Exception('unit was not specified')
-
-#  par.img[-1].freq              = -1.0
-
-    if 'vsys' in config['IMG']:
-        vsys_uds = (config['UDS']['vsys']).split('/')
-        par.img[-1].source_vel = float(config['IMG']['vsys']) * \
-            uds_dict[vsys_uds[0]] / \
-            uds_dict[vsys_uds[1]]  # source velocity in m/s
-#  par.img[-1].theta             = 0.0
-#  par.img[-1].phi               = 0.0
-#  par.img[-1].incl              = 0.0
-#  par.img[-1].posang            = 0.0
-#  par.img[-1].azimuth           = 0.0
-
-    if 'distance' in config['IMG']:
-        par.img[-1].distance = float(config['IMG']['distance']) * \
-            uds_dict[config['UDS']['distance']]
-    else:
-        raise Exception('distance was not specified')
-
-#  par.img[-1].doInterpolateVels = False
-
     if 'fits_file' in config['PARS']:
         fits_filepath = config['PARS']['fits_file']
         # TODO: if name is too large it gets cut -> lime problem?
-        fits_folder = os.path.dirname(fits_filepath)
     else:
-        fits_folder = os.path.dirname(shape_file) + "/gildas/"
-        fits_filepath = fits_folder + "model.fits"
-
-    try:
-        os.makedirs(fits_folder)
-    except OSError as error:
-        if error.errno != errno.EEXIST:
-            raise
-
-    par.img[-1].filename = str(fits_filepath)  # Output filename
+        fits_filepath = os.path.dirname(shape_file) + "/gildas/model.fits"
 
-#  par.img[-1].units = "0,1"
+    # One image per image section (IMG and the extra ones, IMG.1, IMG.2...). All of them are
+    # made from the same grid and level populations, so extra images cost only the ray tracing.
+    #
+    # by default this list par.img has 0 entries. Each 'append' will add an entry. The [-1] entry is the most recently added.
+    for section in image_sections():
+        filename = image_filename(fits_filepath, section)
+        fits_folder = os.path.dirname(filename)
+        try:
+            os.makedirs(fits_folder)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        par.img.append(image_parameters(section, filename))
 
     return par
 
@@ -389,24 +884,19 @@ def density(macros, x, y, z):
   The identity of each collision partner is provided via the list parameter par.collPartIds. If you do provide this, obviously it must have the same number and ordering of elements as the density list you provide here; if you don't include it, LIME will try to guess the identities of the species you provide density values for.
     """
 
-    # Finding nearest point in tabulated data
-    dist, i = kdtree.query((x, y, z))
-
-    # If it is too far, it is considered to be outside of the modelled structure
-    if dist >= max_dist:
+    # If it is too far from the tabulated data, it is considered to be outside of the modelled structure
+    if point.resolve(x, y, z).outside():
         return [1e3]
 
-    if config.getboolean('VARS', 'density') is True:  # density read from tabulated data
-        dens = float(df['Density'][i])
+    if plan.density.from_file:  # density read from tabulated data
+        dens = float(point.sample(shape.density, plan.density.fill))
         if dens <= 1e3:
             dens = 1e3
     else:  # density calculated from analytic function
-        dens_func = config['FUNCS']['dens_func']
-        r = get_radius(x, y, z) / uds_dict[config['UDS']['xyzr']]
+        r = point.radius() / plan.xyzr_factor
 
         # careful not to divide by x,y,z (they can be 0)
-        dens = parser.parse(dens_func).evaluate(
-            {'r': r}) * uds_dict[config['UDS']['density']]
+        dens = plan.density.func(r) * plan.density.factor
 
     return [dens]
 
@@ -418,15 +908,15 @@ def temperature(macros, x, y, z):
   This function should return a tuple of 2 temperatures (in kelvin). The 2nd is optional, i.e. you can return None for it, and LIME will do the rest.
     """
 
-    if config.getboolean('VARS', 'temperature') is True:  # temp read from tabulated data
-        dist, i = kdtree.query((x, y, z))
-        temp = float(df['Temperature'][i])
+    if point.resolve(x, y, z).outside():  # outside of the modelled structure
+        return [0.0, 0.0]
+
+    if plan.temperature.from_file:  # temp read from tabulated data
+        temp = float(point.resolve(x, y, z).sample(shape.temperature, plan.temperature.fill))
     else:  # temp calculated from analytic function
-        temp_func = config['FUNCS']['temp_func']
-        r = get_radius(x, y, z) / uds_dict[config['UDS']['xyzr']]
+        r = point.resolve(x, y, z).radius() / plan.xyzr_factor
 
-        temp = parser.parse(temp_func).evaluate(
-            {'r': r}) * uds_dict[config['UDS']['temperature']]
+        temp = plan.temperature.func(r) * plan.temperature.factor
 
     return [temp, 0.0]
 
@@ -440,14 +930,13 @@ def abundance(macros, x, y, z):
   Note that the 'effective bulk density' mentioned just above is calculated as a weighted sum of the values returned by the density() function, the weights being provided in the par.nMolWeights parameter.
     """
 
+    if point.resolve(x, y, z).outside():  # outside of the modelled structure
+        return [0.0]
+
     # relative abundance calculated from analytic function
-    if 'rel_abundance_func' in config['MOL']:
-        rel_abundance_func = config['MOL']['rel_abundance_func']
-        r = get_radius(x, y, z) / uds_dict[config['UDS']['xyzr']]
+    r = point.radius() / plan.xyzr_factor
 
-        val = parser.parse(rel_abundance_func).evaluate({'r': r})
-    else:
-        raise Exception('rel_abundance_func was not specified')
+    val = plan.abundance.func(r)
 
     listOfAbundances = [val]  # must be a list, even when there is only 1 item.
     return listOfAbundances
@@ -466,19 +955,17 @@ def doppler(macros, x, y, z):
   Note that the present value refers only to the Doppler broadening due to bulk turbulence; LIME later adds in the temperature-dependent part (which also depends on molecular mass).
     """
 
-    # turbulence read from tabulated data
-    if config.getboolean('VARS', 'turbulence') is True:
-        dist, i = kdtree.query((x, y, z))
+    if point.resolve(x, y, z).outside():  # outside of the modelled structure
+        return 0.0
 
-        turb = float(df['Turbulence'][i])
+    # turbulence read from tabulated data
+    if plan.turbulence.from_file:
+        turb = float(point.resolve(x, y, z).sample(shape.turbulence, plan.turbulence.fill))
         return turb
     else:  # turbulence calculated from analytic function
-        turb_func = config['FUNCS']['turb_func']
-        r = get_radius(x, y, z) / uds_dict[config['UDS']['xyzr']]
+        r = point.resolve(x, y, z).radius() / plan.xyzr_factor
 
-        vel_uds = (config['UDS']['turbulence']).split('/')
-        val = parser.parse(turb_func).evaluate(
-            {'r': r}) * uds_dict[vel_uds[0]] / uds_dict[vel_uds[1]]
+        val = plan.turbulence.func(r) * plan.turbulence.factor
 
         return val
 
@@ -493,20 +980,20 @@ def velocity(macros, x, y, z):
 
     vel = [0, 0, 0]  # ini variable
 
+    if point.resolve(x, y, z).outside():  # outside of the modelled structure
+        return vel
+
     # velocity read from tabulated data
-    if config.getboolean('VARS', 'velocity') is True:
-        dist, i = kdtree.query((x, y, z))
-        vel[0] = float(df['Vx'][i])
-        vel[1] = float(df['Vy'][i])
-        vel[2] = float(df['Vz'][i])
+    if plan.velocity.from_file:
+        vel_xyz = point.resolve(x, y, z).sample(shape.velocity, plan.velocity.fill)
+        vel[0] = float(vel_xyz[0])
+        vel[1] = float(vel_xyz[1])
+        vel[2] = float(vel_xyz[2])
     # velocity calculated from RADIAL analytic function
-    elif config['FUNCS']['vel_direction'] == 'radial':
-        vel_func = config['FUNCS']['vel_func']
-        r = get_radius(x, y, z) / uds_dict[config['UDS']['xyzr']]
+    elif plan.velocity.func is not None:
+        r = point.resolve(x, y, z).radius() / plan.xyzr_factor
 
-        vel_uds = (config['UDS']['velocity']).split('/')
-        val = parser.parse(vel_func).evaluate(
-            {'r': r}) * uds_dict[vel_uds[0]] / uds_dict[vel_uds[1]]
+        val = plan.velocity.func(r) * plan.velocity.factor
 
         vel[0] = x*val/r
         vel[1] = y*val/r
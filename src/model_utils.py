@@ -0,0 +1,81 @@
+# Auxiliar functions for Model. They must not import anything from the GUI (tkinter), so Model
+# can be used without a display (see cli.py).
+
+
+def check_format(shape_file, datos_vars, scan=True, workers=1):
+    """Function to check if tabulated file format is what we expect. It expects datos_vars 
+    variables to be the columns of the file, and if velocity (v) is on the list, it expects 
+    'vx', 'vy' and 'vz' columns. It is case insensitive and it expects the delimitator to be \t.
+    Columns are checked reading only the header. If scan is True, the read columns are also scanned
+    once to get their ranges and NaN counts (cached while the file doesn't change).
+
+    Args:
+        shape_file (str): complete path to where the tabulated data file is located.
+        datos_vars (list): list with the variables name expected to appear on the file header.
+        scan (bool, optional): if True, the read columns are scanned. Defaults to True.
+        workers (int, optional): processes used to scan the file. Defaults to 1 (the GUI has
+            several threads, so it must not fork, see shape_data.fork_pool).
+
+    Raises:
+        Exception: if some column is missing or no row has the point coordinates.
+
+    Returns:
+        dict: statistics of the read columns (see shape_data.shape_stats), None if scan is False.
+    """
+    # shape_data needs NumPy, imported here so it is not loaded before the GUI is shown
+    from shape_data import scan_shape, shape_header
+
+    header = shape_header(shape_file)
+    flag = True
+    err_msg = ""
+    for var in datos_vars.keys():
+        if datos_vars[var] is True:
+            if var != "velocity":
+                if var not in header:
+                    err_msg += ("La columna " + str(var) +
+                                " no está en el fichero.\n")
+                    flag = False
+            else:
+                for v in ['vx', 'vy', 'vz']:
+                    if v not in header:
+                        err_msg += ("La columna " + str(var) +
+                                    ' (' + str(v) + ") no está en el fichero.\n")
+                        flag = False
+    if flag is False:
+        raise Exception(
+            err_msg + "El fichero no tiene el formato correcto.")
+
+    if scan is False:
+        return None
+    stats = scan_shape(shape_file, read_columns(datos_vars), workers=workers)
+    if stats['n_points'] == 0:
+        raise Exception("El fichero no tiene ningún punto con coordenadas.")
+    return stats
+
+
+def read_columns(datos_vars):
+    """Lowercase names of the shape file columns that will be read.
+
+    Args:
+        datos_vars (dict): {variable name: True if it is read from the file}.
+
+    Returns:
+        list: column names (velocity is split in vx, vy and vz).
+    """
+    columns = []
+    for var, val in datos_vars.items():
+        if val is True:
+            columns += ['vx', 'vy', 'vz'] if var == 'velocity' else [var]
+    return columns
+
+
+def str2bool(txt):
+    """Transforms str (true o 1) to boolean (True).
+
+    Args:
+        txt (str): text to transform.
+
+    Returns:
+        bool: True if text equals true or 1, else False.
+    """
+    return txt.lower() in ['true', '1']
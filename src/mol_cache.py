@@ -0,0 +1,223 @@
+from collections import OrderedDict
+import json
+import os
+from pathlib import Path
+import pickle
+import threading
+import time
+import warnings
+
+# LAMDA molecule catalogue file, saved in the molecules folder.
+CATALOGUE_FILE = 'lamda_molecules.json'
+# Days before the saved catalogue is downloaded again (if IDEATE is not offline).
+CATALOGUE_MAX_AGE = 30
+
+# Folder (inside the molecules folder) with the parsed molecule tables, and its format version.
+PARSED_DIR = 'parsed'
+PARSED_VERSION = 1
+# Number of parsed molecules kept in memory.
+MOL_LRU_SIZE = 16
+
+
+def tmp_suffix():
+    """Suffix for temporary files, unique for each process and thread.
+
+    Returns:
+        str: suffix.
+    """
+    return '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+
+
+class MolCatalogue:
+    """Persistent cache of the LAMDA molecule catalogue ({molecule name: data file URL}) in the
+    molecules folder, so IDEATE does not need the network to start. The catalogue is downloaded
+    again when it is older than max_age days, and never if offline is True. Instead of LAMDA, a
+    local folder with molecule .dat files can be used as source (e.g. a mirror or test files).
+    """
+
+    def __init__(self, mol_path, max_age=CATALOGUE_MAX_AGE, offline=False, source=None) -> None:
+        """
+        Args:
+            mol_path (Path): molecules folder.
+            max_age (float, optional): days before the catalogue is stale. Defaults to CATALOGUE_MAX_AGE.
+            offline (bool, optional): if True, nothing is downloaded. Defaults to False.
+            source (str, optional): local folder with molecule .dat files used instead of LAMDA. Defaults to None.
+        """
+        self.mol_path = Path(mol_path)
+        self.path = self.mol_path / CATALOGUE_FILE
+        self.max_age = max_age
+        self.offline = offline
+        self.source = Path(source) if source is not None else None
+
+    def molecule_dict(self):
+        """Gets the molecule catalogue. It is read from the molecules folder if it is there and it is
+        not stale (or IDEATE is offline), else it is downloaded and saved. If it cannot be downloaded
+        the saved one is used even if it is stale, and if there is none only the molecules already
+        in the molecules folder are available.
+
+        Returns:
+            dict: {molecule name: data file URL}.
+        """
+        saved = self._read()
+        if saved is not None and (self.offline or time.time() - saved['time'] < self.max_age * 86400):
+            return saved['molecules']
+
+        if not self.offline:
+            try:
+                molecules = self._fetch()
+                self._write(molecules)
+                return molecules
+            except Exception as err:
+                warnings.warn('LAMDA molecule catalogue could not be downloaded: ' + str(err))
+
+        if saved is not None:
+            return saved['molecules']
+        return self.local_molecules()
+
+    def local_molecules(self):
+        """Molecules whose data file is already in the molecules folder.
+
+        Returns:
+            dict: {molecule name: data file URL}.
+        """
+        return {p.stem: p.resolve().as_uri() for p in sorted(self.mol_path.glob('*.dat'))}
+
+    def download(self, mol, outfilename):
+        """Downloads a molecule data file from the catalogue URL.
+
+        Args:
+            mol (str): molecule name.
+            outfilename (str): path of the downloaded file.
+
+        Raises:
+            Exception: if the molecule is unknown or IDEATE is offline and the file is not local.
+        """
+        mol_dic = self.molecule_dict()
+        if mol not in mol_dic:
+            raise Exception("Unknown molecule: " + mol)
+        url = mol_dic[mol]
+        if self.offline and not url.startswith('file:'):
+            raise Exception("Molecule " + mol + " is not downloaded and IDEATE is offline!")
+
+        from urllib.request import urlopen  # it is slow to import and only needed to download
+
+        with urlopen(url) as response:
+            data = response.read()
+        tmp_path = str(outfilename) + tmp_suffix()
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, outfilename)
+
+    def _fetch(self):
+        if self.source is not None:
+            return {p.stem: p.resolve().as_uri() for p in sorted(self.source.glob('*.dat'))}
+
+        from astroquery.lamda import Lamda  # it is slow to import and only needed to download
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return dict(Lamda.molecule_dict)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            if isinstance(saved.get('molecules'), dict):
+                return saved
+        except (OSError, ValueError, AttributeError):
+            pass
+        return None
+
+    def _write(self, molecules):
+        self.mol_path.mkdir(parents=True, exist_ok=True)
+        tmp_path = str(self.path) + tmp_suffix()
+        with open(tmp_path, 'w') as f:
+            json.dump({'time': time.time(), 'molecules': molecules}, f)
+        os.replace(tmp_path, self.path)
+
+
+class MolTables:
+    """Parsed tables of the molecule data files in the molecules folder. Data files are downloaded
+    only once, parsed tables are saved as binary files next to them (parsed again only if the data
+    file changes) and the last used molecules are kept in memory.
+    """
+
+    def __init__(self, catalogue, max_size=MOL_LRU_SIZE) -> None:
+        """
+        Args:
+            catalogue (MolCatalogue): catalogue to download the data files.
+            max_size (int, optional): molecules kept in memory. Defaults to MOL_LRU_SIZE.
+        """
+        self.catalogue = catalogue
+        self.max_size = max_size
+        self.memory = OrderedDict()  # {(mol, size, mtime): tables}, from oldest to newest use
+        self.lock = threading.Lock()  # tables can be got from background threads
+
+    def datafile(self, mol):
+        """Path to a molecule data file, downloaded if it is not in the molecules folder.
+
+        Args:
+            mol (str): molecule name.
+
+        Returns:
+            Path: molecule data file.
+        """
+        path = self.catalogue.mol_path / (mol + '.dat')
+        if not path.exists():
+            self.catalogue.download(mol, str(path))
+        return path
+
+    def get(self, mol):
+        """Gets the parsed tables of a molecule (see astroquery.lamda.parse_lamda_datafile).
+
+        Args:
+            mol (str): molecule name.
+
+        Returns:
+            tuple: (collrates, radtransitions, enlevels).
+        """
+        path = self.datafile(mol)
+        st = path.stat()
+        key = (mol, st.st_size, st.st_mtime)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+        tables = self._load(mol, key)
+        if tables is None:
+            from astroquery.lamda import parse_lamda_datafile  # it is slow to import
+
+            tables = parse_lamda_datafile(str(path))
+            self._save(mol, key, tables)
+
+        with self.lock:
+            self.memory[key] = tables
+            while len(self.memory) > self.max_size:
+                self.memory.popitem(last=False)
+        return tables
+
+    def _parsed_path(self, mol):
+        return self.catalogue.mol_path / PARSED_DIR / (mol + '.pkl')
+
+    def _load(self, mol, key):
+        try:
+            with open(self._parsed_path(mol), 'rb') as f:
+                saved = pickle.load(f)
+            if saved['version'] == PARSED_VERSION and saved['key'] == key:
+                return saved['tables']
+        except Exception:  # not parsed yet or written by an incompatible version
+            pass
+        return None
+
+    def _save(self, mol, key, tables):
+        parsed_path = self._parsed_path(mol)
+        parsed_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = str(parsed_path) + tmp_suffix()
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': PARSED_VERSION, 'key': key, 'tables': tables}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, parsed_path)
+        except (OSError, pickle.PicklingError):
+            pass  # tables are still usable, they will be parsed again next time
@@ -0,0 +1,849 @@
+# -*- coding: utf-8 -*-
+# Shape tabulated data reading and caching. It is used by lime_model.py (run by pylime), so it is
+# copied next to it and it must not import anything from the GUI.
+
+from bisect import bisect_left, bisect_right
+import copy
+import errno
+import hashlib
+import json
+from io import BytesIO
+import math
+import multiprocessing
+import os
+import pickle
+import re as reg
+import shutil
+
+import numpy
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Bump it when the layout or the content of the cache entries changes.
+CACHE_VERSION = 3
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.ideate', 'cache')
+
+COORDS = ['Px', 'Py', 'Pz']
+COORD_NAMES = [c.lower() for c in COORDS]
+
+# Bytes of the shape file parsed at once (by each worker process), and type of the physical fields
+# read from it (coordinates are kept as float64 to find the grid spacing exactly).
+READ_RANGE_BYTES = 1 << 25
+FIELD_DTYPE = numpy.float32
+
+
+def makedirs(path):
+    """Creates a folder (and its parents) if it does not exist.
+
+    Args:
+        path (str): folder path.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+
+def file_hash(path, cache_dir=CACHE_DIR):
+    """Content hash (sha1) of a file. Hashes are remembered by path, size and modification time in
+    a small record per file in cache_dir, so an unchanged file is only read once, also by runs
+    started at the same time (they wait for the first one, see BuildLock).
+
+    Args:
+        path (str): file path.
+        cache_dir (str, optional): cache folder. Defaults to CACHE_DIR.
+
+    Returns:
+        str: hexadecimal sha1 of the file content.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stat_key = [path, st.st_size, st.st_mtime]
+    record_path = os.path.join(cache_dir, 'hashes',
+                               hashlib.sha1(path.encode('utf-8')).hexdigest() + '.json')
+
+    def remembered():
+        try:
+            with open(record_path) as f:
+                record = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        return record[3] if record[:3] == stat_key else None
+
+    digest = remembered()
+    if digest is not None:
+        return digest
+
+    with BuildLock(record_path):
+        digest = remembered()  # it may have been hashed while waiting
+        if digest is not None:
+            return digest
+
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+
+        makedirs(os.path.dirname(record_path))
+        tmp_path = record_path + '.' + str(os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(stat_key + [digest], f)
+        os.rename(tmp_path, record_path)
+    return digest
+
+
+def count_lines(path):
+    """Number of lines of a file, counting newlines by blocks (without parsing it).
+
+    Args:
+        path (str): file path.
+
+    Returns:
+        int: number of lines (a last line without newline is counted too).
+    """
+    n_lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            n_lines += block.count(b'\n')
+            last = block[-1:]
+    return n_lines + (last != b'\n')
+
+
+def header_names(shape_file):
+    """Column names of the shape tabulated data file in order, reading only its first line.
+
+    Args:
+        shape_file (str): path to the shape tabulated data file.
+
+    Returns:
+        list: column names (as they are in the file).
+    """
+    with open(shape_file) as f:
+        return f.readline().rstrip('\r\n').split('\t')
+
+
+def shape_header(shape_file):
+    """Column names of the shape tabulated data file, reading only its first line.
+
+    Args:
+        shape_file (str): path to the shape tabulated data file.
+
+    Returns:
+        dict: {lowercase column name: column name in the file}, without unnamed columns.
+    """
+    return dict((name.lower(), name) for name in header_names(shape_file)
+                if len(name) > 0 and not reg.match("Unnamed*", name))
+
+
+def line_ranges(path, range_bytes):
+    """Splits a file after its header in byte ranges of about range_bytes, each one starting at the
+    beginning of a line and ending after the end of a line.
+
+    Args:
+        path (str): file path.
+        range_bytes (int): approximate size of each range.
+
+    Returns:
+        list: [(start, end)] byte offsets, in order.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        while size - bounds[-1] > range_bytes:
+            f.seek(bounds[-1] + range_bytes - 1)
+            f.readline()  # to the beginning of the next line
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_range(args):
+    """Parses a byte range of the shape tabulated data file (see line_ranges), removing the rows
+    without coordinates. It runs in the worker processes of read_shape.
+
+    Args:
+        args (tuple): (shape file path, (start, end), {column position: dtype},
+            positions of the coordinates columns).
+
+    Returns:
+        dict: {column position: 1D array}.
+    """
+    import pandas as pd
+
+    shape_file, (start, end), dtypes, coord_positions = args
+    with open(shape_file, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start)
+    if len(text.strip()) == 0:
+        return dict((pos, numpy.empty(0, dtype=dtype)) for pos, dtype in dtypes.items())
+
+    chunk = pd.read_csv(BytesIO(text), sep='\t', header=None, usecols=list(dtypes),
+                        dtype=dtypes)
+    chunk = chunk.dropna(subset=coord_positions)
+    return dict((pos, chunk[pos].to_numpy()) for pos in dtypes)
+
+
+def fork_pool(workers):
+    """Pool of worker processes to parse the shape file or evaluate the pregrid. Workers are always
+    forked (also where spawn or forkserver are the default), so they already have the data of this
+    process, and because pylime embeds Python and cannot be started again as a spawned process.
+    Forking a process with several threads can deadlock the children, so multi-threaded callers
+    (e.g. the GUI) must use one worker.
+
+    Args:
+        workers (int): number of processes.
+
+    Returns:
+        multiprocessing.Pool: the pool, or None if processes cannot be forked in this system.
+    """
+    if not hasattr(multiprocessing, 'get_context'):  # Python 2 (pylime), it always forks in Unix
+        return multiprocessing.Pool(workers) if os.name == 'posix' else None
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context('fork').Pool(workers)
+
+
+def read_shape(shape_file, columns, workers=None, range_bytes=READ_RANGE_BYTES):
+    """Reads some columns of the shape tabulated data file (tab separated), removing the rows
+    without coordinates. The file is split in byte ranges at line boundaries, parsed by several
+    worker processes if it is big enough, and their columns are copied in order in preallocated
+    arrays (Px, Py and Pz as float64, the rest as FIELD_DTYPE), so the whole file is never in memory
+    as a table.
+
+    Args:
+        shape_file (str): path to the shape tabulated data file.
+        columns (list): column names (case insensitive). Coordinates are always read.
+        workers (int, optional): number of processes. Defaults to the number of CPUs.
+        range_bytes (int, optional): approximate size of the parsed ranges. Defaults to
+            READ_RANGE_BYTES.
+
+    Raises:
+        Exception: if some column is not in the file.
+
+    Returns:
+        dict: {column name (as in columns, Px, Py and Pz for the coordinates): 1D array}.
+    """
+    header = shape_header(shape_file)
+    columns = COORDS + [c for c in columns if c.lower() not in COORD_NAMES]
+    missing = [c for c in columns if c.lower() not in header]
+    if len(missing) > 0:
+        raise Exception('Columns not found in ' + shape_file + ': ' + ', '.join(missing))
+
+    names = header_names(shape_file)
+    positions = dict((c, names.index(header[c.lower()])) for c in columns)
+    dtypes = dict((positions[c], numpy.float64 if c in COORDS else FIELD_DTYPE)
+                  for c in columns)
+    coord_positions = [positions[c] for c in COORDS]
+
+    n_rows = max(count_lines(shape_file) - 1, 0)  # upper bound, without the header
+    arrays = dict((c, numpy.empty(n_rows, dtype=dtypes[positions[c]])) for c in columns)
+
+    tasks = [(shape_file, r, dtypes, coord_positions)
+             for r in line_ranges(shape_file, range_bytes)]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = fork_pool(min(workers, len(tasks))) if workers > 1 and len(tasks) > 1 else None
+
+    n_points = 0
+    try:
+        parsed = pool.imap(parse_range, tasks) if pool is not None else map(parse_range, tasks)
+        for part in parsed:
+            n_part = len(part[coord_positions[0]])
+            for c in columns:
+                arrays[c][n_points:n_points + n_part] = part[positions[c]]
+            n_points += n_part
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return dict((c, arr[:n_points]) for c, arr in arrays.items())
+
+
+def shape_stats(columns):
+    """Statistics of the shape data, computed with NumPy in one pass over each column. They are
+    plain numbers, so they can be saved as JSON.
+
+    Args:
+        columns (dict): {column name: 1D array}. Coordinates must be named Px, Py and Pz.
+
+    Returns:
+        dict: {'n_points': number of points,
+            'columns': {column name: {'min': minimum, 'max': maximum, 'nan': number of NaN values}},
+            'axes': {coordinate name: {'n_values': number of different values,
+                'min_step': minimum spacing, 'max_step': maximum spacing}}}.
+    """
+    stats = {'n_points': 0, 'columns': {}, 'axes': {}}
+    for name, col in columns.items():
+        col = numpy.asarray(col, dtype=numpy.float64)
+        stats['n_points'] = max(stats['n_points'], len(col))
+        nan = numpy.isnan(col)
+        n_nan = int(nan.sum())
+        valid = col[~nan] if n_nan > 0 else col
+        stats['columns'][name] = {'min': float(valid.min()) if len(valid) > 0 else None,
+                                  'max': float(valid.max()) if len(valid) > 0 else None,
+                                  'nan': n_nan}
+        if name in COORDS:
+            steps = numpy.diff(numpy.unique(valid))
+            stats['axes'][name] = {'n_values': len(steps) + 1 if len(valid) > 0 else 0,
+                                   'min_step': float(steps.min()) if len(steps) > 0 else 0.0,
+                                   'max_step': float(steps.max()) if len(steps) > 0 else 0.0}
+    return stats
+
+
+def stats_path(shape_file, columns, cache_dir=CACHE_DIR):
+    """Path of the saved statistics of some columns of the shape file (by file content and columns).
+
+    Args:
+        shape_file (str): path to the shape tabulated data file.
+        columns (list): column names (case insensitive). Coordinates are always included.
+        cache_dir (str, optional): cache folder. Defaults to CACHE_DIR.
+
+    Returns:
+        str: JSON file path.
+    """
+    key = json.dumps([CACHE_VERSION, file_hash(shape_file, cache_dir),
+                      sorted(set(c.lower() for c in list(columns) + COORDS))])
+    return os.path.join(cache_dir, 'stats', hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def save_stats(path, stats):
+    """Saves statistics (see stats_path) as JSON. The file is written with another name and renamed,
+    so readers never see it half written.
+
+    Args:
+        path (str): JSON file path.
+        stats (dict): statistics from shape_stats.
+    """
+    makedirs(os.path.dirname(path))
+    tmp_path = path + '.' + str(os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(stats, f)
+    os.rename(tmp_path, path)
+
+
+def file_stats(shape_file, data):
+    """Statistics (see shape_stats) of columns read by read_shape, named as in the file header.
+
+    Args:
+        shape_file (str): path to the shape tabulated data file.
+        data (dict): {column name (case insensitive): 1D array}, from read_shape.
+
+    Returns:
+        dict: statistics of the columns.
+    """
+    header = shape_header(shape_file)
+    return shape_stats(dict((c if c in COORDS else header.get(c.lower(), c), arr)
+                            for c, arr in data.items()))
+
+
+def scan_shape(shape_file, columns, cache_dir=CACHE_DIR, workers=None):
+    """Statistics (see shape_stats) of some columns of the shape tabulated data file, from one
+    streaming pass over it. They are saved in cache_dir by file content and columns, so an unchanged
+    file (same size and modification time, see file_hash) is not read again. ShapeCache saves them
+    too when it reads the file, so the GUI check and the LIME model share them.
+
+    Args:
+        shape_file (str): path to the shape tabulated data file.
+        columns (list): column names (case insensitive). Coordinates are always read.
+        cache_dir (str, optional): cache folder. Defaults to CACHE_DIR.
+        workers (int, optional): number of processes (see read_shape). Defaults to the number of CPUs.
+
+    Returns:
+        dict: statistics of the read columns, by their name in the file.
+    """
+    path = stats_path(shape_file, columns, cache_dir)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        pass
+
+    stats = file_stats(shape_file, read_shape(shape_file, columns, workers=workers))
+    save_stats(path, stats)
+    return stats
+
+
+def max_spacing(stats):
+    """Length of the diagonal of the biggest gap between the shape grid points, from shape_stats.
+
+    Args:
+        stats (dict): statistics from shape_stats.
+
+    Returns:
+        float: maximum distance between neighbour points (in the units of the coordinates).
+    """
+    return math.sqrt(sum(stats['axes'][c]['max_step']**2 for c in COORDS))
+
+
+class BuildLock(object):
+    """Context manager that holds an exclusive lock (a lock file next to path) while a cache entry
+    is built, so runs started at the same time wait for the first one instead of building it again.
+    The lock file is removed when the block ends without errors: the entry exists then, and runs
+    still waiting check it again after getting the lock. Without fcntl (Windows) it does nothing.
+    """
+
+    def __init__(self, path):
+        self.lock_path = path + '.lock'
+        self.lock_file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            makedirs(os.path.dirname(self.lock_path))
+            self.lock_file = open(self.lock_path, 'a')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.lock_file is not None:
+            if exc_type is None:
+                try:
+                    os.remove(self.lock_path)
+                except OSError:
+                    pass
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+        return False
+
+
+class ShapeCache(object):
+    """Persistent cache of a preprocessed shape file. Each entry is a folder inside cache_dir named
+    after the file content hash and the conversion applied to it, holding one .npy file per array
+    (memory-mapped when loaded) and pickled objects built from them (e.g. the KD-tree). Array
+    attributes of the objects listed in their ARRAYS class attribute are saved as .npy files too.
+    """
+
+    def __init__(self, shape_file, fields, cache_dir=CACHE_DIR):
+        """
+        Args:
+            shape_file (str): path to the shape tabulated data file.
+            fields (dict): {array name: (column name or list of column names, conversion factor)}.
+            cache_dir (str, optional): cache folder. Defaults to CACHE_DIR.
+        """
+        self.shape_file = shape_file
+        self.fields = fields
+        self.cache_dir = cache_dir
+
+        key = json.dumps([CACHE_VERSION, file_hash(shape_file, cache_dir),
+                          sorted([name, cols, repr(float(factor))] for name, (cols, factor) in fields.items())])
+        self.path = os.path.join(
+            cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def arrays(self):
+        """Cleaned and converted arrays of the shape file. They are read from the cache entry if it
+        exists, else the shape file is read and the entry is created.
+
+        Returns:
+            dict: {array name: numpy array}.
+        """
+        if not os.path.isdir(self.path):
+            with BuildLock(self.path):
+                if not os.path.isdir(self.path):  # it may have been built while waiting
+                    self._build()
+        return dict((name, numpy.load(os.path.join(self.path, name + '.npy'), mmap_mode='r'))
+                    for name in self.fields)
+
+    def columns(self):
+        """Shape file columns read for the fields.
+
+        Returns:
+            list: column names.
+        """
+        columns = []
+        for cols, factor in self.fields.values():
+            columns += cols if isinstance(cols, list) else [cols]
+        return columns
+
+    def stats(self):
+        """Statistics of the read columns, in the units of the file (see scan_shape). They are
+        saved when the entry is built, so they are only computed here for entries built before.
+
+        Returns:
+            dict: statistics from shape_stats, by column name in the file.
+        """
+        return scan_shape(self.shape_file, self.columns(), self.cache_dir)
+
+    def _build(self):
+        data = read_shape(self.shape_file, self.columns())
+        # Same statistics scan_shape would compute, so the GUI check doesn't read the file again
+        save_stats(stats_path(self.shape_file, self.columns(), self.cache_dir),
+                   file_stats(self.shape_file, data))
+
+        # The entry is written in a temporary folder and renamed, so other runs never see it half done.
+        tmp_path = self.path + '.tmp-' + str(os.getpid())
+        makedirs(tmp_path)
+        for name, (cols, factor) in self.fields.items():
+            if isinstance(cols, list):
+                arr = numpy.column_stack([data[c] for c in cols]) * factor
+            else:
+                arr = data[cols] * factor
+            numpy.save(os.path.join(tmp_path, name + '.npy'),
+                       numpy.ascontiguousarray(arr))
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:  # another run created it first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def get(self, name, build):
+        """Object stored in the cache entry, built and stored the first time it is asked.
+
+        Args:
+            name (str): object name.
+            build (function): function without arguments that creates the object.
+
+        Returns:
+            object: cached object.
+        """
+        obj_path = os.path.join(self.path, name + '.pkl')
+        try:
+            return self._load(obj_path)
+        except Exception:  # not cached yet or written by an incompatible version
+            pass
+
+        with BuildLock(obj_path):
+            try:  # it may have been built while waiting
+                return self._load(obj_path)
+            except Exception:
+                pass
+            return self._store(obj_path, build())
+
+    def _load(self, obj_path):
+        with open(obj_path, 'rb') as f:
+            obj = pickle.load(f)
+        for attr in getattr(obj, 'ARRAYS', ()):
+            arr_path = obj_path[:-len('.pkl')] + '.' + attr + '.npy'
+            if getattr(obj, attr) is None and os.path.exists(arr_path):
+                setattr(obj, attr, numpy.load(arr_path, mmap_mode='r'))
+        return obj
+
+    def _store(self, obj_path, obj):
+        # Arrays are written before the pickle, so a stored object always has them
+        state = obj
+        arrays = dict((attr, getattr(obj, attr)) for attr in getattr(obj, 'ARRAYS', ())
+                      if getattr(obj, attr) is not None)
+        if len(arrays) > 0:
+            state = copy.copy(obj)
+            for attr in arrays:
+                setattr(state, attr, None)
+        tmp_path = obj_path + '.' + str(os.getpid())
+        try:
+            for attr, arr in arrays.items():
+                arr_path = obj_path[:-len('.pkl')] + '.' + attr + '.npy'
+                with open(tmp_path, 'wb') as f:
+                    numpy.save(f, numpy.ascontiguousarray(arr))
+                os.rename(tmp_path, arr_path)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=2)
+            os.rename(tmp_path, obj_path)
+        except (IOError, OSError, pickle.PicklingError):
+            pass  # the object is still usable, it will be built again next time
+        return obj
+
+
+# A shape grid is treated as a lattice if it fills at least this fraction of the cells defined
+# by its axes (else it is considered scattered data).
+LATTICE_MIN_FILL = 1e-3
+# Up to this number of cells per point the cells are kept in a dense 3D array, else in a sorted map.
+LATTICE_MAX_DENSE = 8
+
+
+class Lattice(object):
+    """Regular or rectilinear grid of points. The nearest grid node to any point is found by
+    computing its index on each axis (a few arithmetic operations for evenly spaced axes, a
+    bisection for uneven ones), instead of searching a KD-tree.
+    """
+
+    # Saved as .npy files and memory-mapped when it is loaded from the shape cache
+    ARRAYS = ('cells', 'keys')
+
+    def __init__(self, coords):
+        """
+        Args:
+            coords (numpy array): n x 3 array with the points coordinates, which lie on the grid.
+        """
+        self.axes = []
+        self.starts = []
+        self.inv_steps = []
+        idx = []
+        for k in range(3):
+            axis, inverse = numpy.unique(coords[:, k], return_inverse=True)
+            self.axes.append(axis.tolist())
+            idx.append(inverse.reshape(-1))
+            steps = numpy.diff(axis)
+            # Evenly spaced axes get the index by arithmetic, else bisect is used (inv_step None)
+            if len(steps) > 0 and numpy.allclose(steps, steps[0], rtol=1e-6, atol=0):
+                self.starts.append(float(axis[0]))
+                self.inv_steps.append(1.0 / float(steps[0]))
+            else:
+                self.starts.append(None)
+                self.inv_steps.append(None)
+
+        self.shape = tuple(len(axis) for axis in self.axes)
+        n_cells = self.shape[0] * self.shape[1] * self.shape[2]
+        # Row numbers (cells) as int32 if possible, half the memory of int64
+        row_dtype = numpy.int32 if len(coords) < 2**31 else numpy.int64
+        rows = numpy.arange(len(coords), dtype=row_dtype)
+        if n_cells <= LATTICE_MAX_DENSE * len(coords):
+            self.cells = numpy.full(self.shape, -1, dtype=row_dtype)
+            self.cells[idx[0], idx[1], idx[2]] = rows
+            self.keys = None
+        else:
+            keys = numpy.ravel_multi_index(idx, self.shape)
+            order = numpy.argsort(keys)
+            self.keys = keys[order]
+            self.cells = rows[order]
+
+    def axis_index(self, k, val):
+        """Index of the nearest node to val on axis k.
+
+        Args:
+            k (int): axis (0, 1 or 2).
+            val (float): coordinate.
+
+        Returns:
+            int: node index.
+        """
+        n = self.shape[k]
+        if self.inv_steps[k] is not None:
+            i = int(round((val - self.starts[k]) * self.inv_steps[k]))
+        else:
+            axis = self.axes[k]
+            i = bisect_left(axis, val)
+            if i > 0 and (i == n or val - axis[i-1] <= axis[i] - val):
+                i -= 1
+        if i < 0:
+            return 0
+        if i >= n:
+            return n - 1
+        return i
+
+    def nearest(self, x, y, z):
+        """Nearest point of the grid.
+
+        Args:
+            x (float): x-coordinate.
+            y (float): y-coordinate.
+            z (float): z-coordinate.
+
+        Returns:
+            tuple: (distance to the nearest point, its row index), or None if the nearest grid
+                node is empty (then the nearest point has to be searched some other way).
+        """
+        ix = self.axis_index(0, x)
+        iy = self.axis_index(1, y)
+        iz = self.axis_index(2, z)
+        i = self.row(ix, iy, iz)
+        if i < 0:
+            return None
+        dx = x - self.axes[0][ix]
+        dy = y - self.axes[1][iy]
+        dz = z - self.axes[2][iz]
+        return math.sqrt(dx*dx + dy*dy + dz*dz), i
+
+    def row(self, ix, iy, iz):
+        """Row index of the point in a grid node.
+
+        Args:
+            ix (int): node index on x axis.
+            iy (int): node index on y axis.
+            iz (int): node index on z axis.
+
+        Returns:
+            int: row index, -1 if the node is empty.
+        """
+        if self.keys is None:
+            return int(self.cells[ix, iy, iz])
+        key = (ix * self.shape[1] + iy) * self.shape[2] + iz
+        pos = numpy.searchsorted(self.keys, key)
+        if pos < len(self.keys) and self.keys[pos] == key:
+            return int(self.cells[pos])
+        return -1
+
+    def axis_cell(self, k, val):
+        """Cell of axis k that contains val.
+
+        Args:
+            k (int): axis (0, 1 or 2).
+            val (float): coordinate.
+
+        Returns:
+            tuple: (index of the lower node, fraction of the way to the upper node), or None if
+                val is outside the axis.
+        """
+        axis = self.axes[k]
+        n = self.shape[k]
+        if n == 1:  # flat grid along this axis
+            return 0, 0.0
+        if val < axis[0] or val > axis[-1]:
+            return None
+        if self.inv_steps[k] is not None:
+            i = int((val - self.starts[k]) * self.inv_steps[k])
+        else:
+            i = bisect_right(axis, val) - 1
+        i = min(max(i, 0), n - 2)
+        return i, min(max((val - axis[i]) / (axis[i+1] - axis[i]), 0.0), 1.0)
+
+    def trilinear(self, x, y, z):
+        """Trilinear interpolation stencil of a point: the nodes of its grid cell and their weights.
+        Empty nodes are left out and the weights of the rest are normalized.
+
+        Args:
+            x (float): x-coordinate.
+            y (float): y-coordinate.
+            z (float): z-coordinate.
+
+        Returns:
+            tuple: (list of row indexes, list of weights), or None if the point is outside the
+                grid or all the nodes of its cell with weight are empty.
+        """
+        cells = [self.axis_cell(0, x), self.axis_cell(1, y), self.axis_cell(2, z)]
+        if None in cells:
+            return None
+        (ix, fx), (iy, fy), (iz, fz) = cells
+
+        rows = []
+        weights = []
+        for dx, wx in ((0, 1.0 - fx), (1, fx)):
+            for dy, wy in ((0, 1.0 - fy), (1, fy)):
+                for dz, wz in ((0, 1.0 - fz), (1, fz)):
+                    w = wx * wy * wz
+                    if w <= 0:
+                        continue
+                    i = self.row(ix + dx, iy + dy, iz + dz)
+                    if i >= 0:
+                        rows.append(i)
+                        weights.append(w)
+
+        total = sum(weights)
+        if total <= 0:
+            return None
+        return rows, [w / total for w in weights]
+
+
+def build_lattice(coords, stats=None):
+    """Creates the Lattice of the points if they form a regular or rectilinear grid.
+
+    Args:
+        coords (numpy array): n x 3 array with the points coordinates.
+        stats (dict, optional): statistics of the points from shape_stats, to avoid computing
+            the number of values of each axis again. Defaults to None.
+
+    Returns:
+        Lattice: lattice of the points, or None if they are scattered.
+    """
+    n_cells = 1
+    for k in range(3):
+        if stats is not None:
+            n_cells *= stats['axes'][COORDS[k]]['n_values']
+        else:
+            n_cells *= len(numpy.unique(coords[:, k]))
+    if len(coords) == 0 or len(coords) < LATTICE_MIN_FILL * n_cells:
+        return None
+    return Lattice(coords)
+
+
+class Triangulation(object):
+    """Delaunay triangulation of scattered points, to interpolate linearly inside the tetrahedron
+    that contains each point. It is built once and stored in the shape cache, as it is the slow part.
+    """
+
+    def __init__(self, coords):
+        """
+        Args:
+            coords (numpy array): n x 3 array with the points coordinates.
+        """
+        from scipy.spatial import Delaunay
+
+        self.tri = Delaunay(coords)
+
+    def linear(self, x, y, z):
+        """Linear interpolation stencil of a point: the vertices of its tetrahedron and their
+        barycentric weights.
+
+        Args:
+            x (float): x-coordinate.
+            y (float): y-coordinate.
+            z (float): z-coordinate.
+
+        Returns:
+            tuple: (list of row indexes, list of weights), or None if the point is outside the
+                convex hull of the points.
+        """
+        p = numpy.array((x, y, z))
+        simplex = int(self.tri.find_simplex(p))
+        if simplex < 0:
+            return None
+        transform = self.tri.transform[simplex]
+        b = transform[:3].dot(p - transform[3])
+        weights = [float(b[0]), float(b[1]), float(b[2]), 1.0 - float(b.sum())]
+        return [int(i) for i in self.tri.simplices[simplex]], weights
+
+
+# Maximum number of voxels per point of the occupancy bitmap (voxels get bigger if needed).
+OCCUPANCY_MAX_VOXELS = 8
+
+
+class Occupancy(object):
+    """Coarse voxel bitmap of the space around the points, to reject quickly points far from all of
+    them. Voxels are at least max_dist wide and are marked if they or any of their 26 neighbours
+    have a point, so a point in an unmarked voxel (or outside the bounding box) is at least max_dist
+    away from every point, without any nearest point search.
+    """
+
+    def __init__(self, coords, max_dist):
+        """
+        Args:
+            coords (numpy array): n x 3 array with the points coordinates.
+            max_dist (float): distance from which a point is considered far from the points.
+        """
+        lo = coords.min(axis=0)
+        hi = coords.max(axis=0)
+        side = float(max_dist)
+        max_voxels = OCCUPANCY_MAX_VOXELS * len(coords) + 27
+        while numpy.prod(numpy.floor((hi - lo) / side) + 3) > max_voxels:
+            side *= 2
+        self.inv_side = 1.0 / side
+        # One empty voxel layer on each side, so neighbours of the border voxels exist
+        self.lo = [float(v) for v in lo - side]
+        self.shape = tuple(int(v) for v in numpy.floor((hi - lo) / side) + 3)
+
+        bitmap = numpy.zeros(self.shape, dtype=bool)
+        idx = numpy.floor((coords - (lo - side)) * self.inv_side).astype(numpy.int64)
+        bitmap[idx[:, 0], idx[:, 1], idx[:, 2]] = True
+        for k in range(3):  # dilation with a 3x3x3 cube, one axis at a time
+            dilated = bitmap.copy()
+            lower = [slice(None)] * 3
+            upper = [slice(None)] * 3
+            lower[k] = slice(0, -1)
+            upper[k] = slice(1, None)
+            dilated[tuple(lower)] |= bitmap[tuple(upper)]
+            dilated[tuple(upper)] |= bitmap[tuple(lower)]
+            bitmap = dilated
+        self.bitmap = bitmap
+
+    def near(self, x, y, z):
+        """Checks if a point may be closer than max_dist to some of the points.
+
+        Args:
+            x (float): x-coordinate.
+            y (float): y-coordinate.
+            z (float): z-coordinate.
+
+        Returns:
+            bool: False if the point is surely at least max_dist away from all the points.
+        """
+        ix = int(math.floor((x - self.lo[0]) * self.inv_side))
+        iy = int(math.floor((y - self.lo[1]) * self.inv_side))
+        iz = int(math.floor((z - self.lo[2]) * self.inv_side))
+        if ix < 0 or iy < 0 or iz < 0 or ix >= self.shape[0] or iy >= self.shape[1] or iz >= self.shape[2]:
+            return False
+        return bool(self.bitmap[ix, iy, iz])
@@ -0,0 +1,225 @@
+# Parameter sweeps: the same model (a .bak file saved by IDEATE) run with several values of some
+# parameters. Usage: python src/sweep.py <sweep file>. Sweep file example:
+#
+#   [SWEEP]
+#   base = /home/user/models/model.bak
+#   mode = product          ; every combination of the values (or list: i-th value of each one)
+#   output_dir = /home/user/models/sweep
+#   cores = 32              ; cores used by all the runs at the same time
+#   threads = 4             ; LIME threads of each run
+#
+#   [VALUES]
+#   MOL.mol_name = co, hco+
+#   MOL.trans = 1, 2
+#   IMG.distance = 100, 200
+#
+# Each variant gets its own .fits (and .bak) in output_dir, and sweep_index.csv lists them.
+# Variants only changing molecules or images reuse the shape cache of the first run.
+
+import argparse
+import configparser
+import csv
+import io
+import itertools
+import multiprocessing
+from pathlib import Path
+import time
+
+from jobs import ACTIVE, MODEL_FILES, JobManager, lime_command
+from mol_cache import MolCatalogue, MolTables
+
+SRC_PATH = Path(__file__).resolve().parent
+INDEX_FILE = 'sweep_index.csv'
+WAIT_INTERVAL = 1.0   # seconds between checks of the running variants
+
+
+def expand_sweep(values, mode='product'):
+    """Expands the sweep values into variants.
+
+    Args:
+        values (dict): {'SECTION.key': list of values}.
+        mode (str, optional): 'product' (every combination) or 'list' (i-th value of every
+            parameter, all the lists must be equally long). Defaults to 'product'.
+
+    Raises:
+        Exception: if mode is unknown or lists lengths don't match in list mode.
+
+    Returns:
+        list: variants, {'SECTION.key': value}.
+    """
+    keys = list(values)
+    lists = [values[key] for key in keys]
+    if mode == 'product':
+        combinations = itertools.product(*lists)
+    elif mode == 'list':
+        if len(set(len(vals) for vals in lists)) > 1:
+            raise Exception(
+                "In list mode all the parameters must have the same number of values!")
+        combinations = zip(*lists)
+    else:
+        raise Exception("Sweep mode must be product or list!")
+    return [dict(zip(keys, combination)) for combination in combinations]
+
+
+def read_lime_path():
+    """LIME folder from IDEATE ini configuration file (as Model).
+
+    Returns:
+        Path: LIME folder, None if pylime is already a command.
+    """
+    ini_config = configparser.ConfigParser()
+    ini_config.read(SRC_PATH.parents[0] / "ideate_config.ini")
+    if 'CONFIG' in ini_config and 'lime_path' in ini_config['CONFIG']:
+        return Path(ini_config['CONFIG']['lime_path'])
+    return None
+
+
+class Sweep:
+    """Parameter sweep read from a sweep file (see the example at the top of this file).
+    """
+
+    def __init__(self, path) -> None:
+        """
+        Args:
+            path (str): sweep file path.
+
+        Raises:
+            Exception: if the sweep file or its base file are wrong.
+        """
+        path = Path(path)
+        sweep_config = configparser.ConfigParser()
+        sweep_config.read(path)
+        if 'SWEEP' not in sweep_config or 'base' not in sweep_config['SWEEP']:
+            raise Exception("The sweep file must have a base .bak file in SWEEP section!")
+        pars = sweep_config['SWEEP']
+
+        self.base_path = Path(pars['base'])
+        self.base = configparser.ConfigParser()
+        if not self.base.read(self.base_path):
+            raise Exception("Base file " + str(self.base_path) + " not found!")
+
+        self.mode = pars.get('mode', 'product')
+        self.output_dir = Path(pars.get('output_dir', str(path.with_suffix(''))))
+        self.threads = max(pars.getint('threads', 1), 1)
+        self.cores = pars.getint('cores', multiprocessing.cpu_count())
+
+        # Option names are lowercase in configparser, IDEATE sections are uppercase
+        self.values = {}
+        if 'VALUES' in sweep_config:
+            for name, text in sweep_config['VALUES'].items():
+                section, _, key = name.rpartition('.')  # extra images: IMG.1.trans
+                if section.upper() not in self.base or len(key) == 0:
+                    raise Exception("Unknown sweep parameter: " + name)
+                self.values[section.upper() + '.' + key] = [val.strip() for val in text.split(',')]
+
+        self.variants = expand_sweep(self.values, self.mode)
+        self.jobs = []  # Job of each variant, see run
+
+    def configs(self):
+        """Config of each variant: base config with the variant values, its own output .fits, LIME
+        threads and pregrid processes (and molecule data file if the molecule changes).
+
+        Returns:
+            list: configparser.ConfigParser objects.
+        """
+        mol_tables = None
+        configs = []
+        for k, variant in enumerate(self.variants):
+            config = configparser.ConfigParser()
+            config.read_dict(self.base)
+            for name, val in variant.items():
+                section, key = name.rsplit('.', 1)
+                config[section][key] = val
+
+            if 'MOL.mol_name' in variant:
+                if mol_tables is None:
+                    mol_dir = Path(self.base['MOL']['moldatfile']).parent
+                    mol_tables = MolTables(MolCatalogue(mol_dir))
+                config['MOL']['moldatfile'] = str(
+                    mol_tables.datafile(variant['MOL.mol_name']))
+
+            config['PARS']['fits_file'] = str(self.fits_file(k))
+            config['PARS']['nthreads'] = str(self.threads)
+            config['PARS']['pregrid_workers'] = str(self.threads)  # else all CPUs for each run
+            configs.append(config)
+        return configs
+
+    def fits_file(self, k):
+        """Output .fits file of a variant.
+
+        Args:
+            k (int): variant number.
+
+        Returns:
+            Path: .fits file path.
+        """
+        return self.output_dir / (self.base_path.stem + '_' + str(k).zfill(3) + '.fits')
+
+    def run(self, wait=True):
+        """Runs the variants, as many at the same time as cores allow (cores / threads), and writes
+        the index of outputs (sweep_index.csv in output_dir) as they finish.
+
+        Args:
+            wait (bool, optional): if True, it returns when all the runs finish. Defaults to True.
+
+        Returns:
+            JobManager: manager of the variant jobs.
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        jobs = JobManager(self.output_dir / 'jobs', max_running=self.cores // self.threads)
+        command = lime_command(read_lime_path())
+
+        self.jobs = []
+        for k, config in enumerate(self.configs()):
+            config_text = io.StringIO()
+            config.write(config_text)
+            with open(self.fits_file(k).with_suffix('.bak'), 'w') as bak_file:
+                bak_file.write(config_text.getvalue())
+            self.jobs.append(jobs.submit(self.fits_file(k).stem, command,
+                                         files={'lime_config.ini': config_text.getvalue()},
+                                         copy_files=[SRC_PATH / model_file
+                                                     for model_file in MODEL_FILES]))
+        self.write_index()
+
+        if wait:
+            statuses = [job.status for job in self.jobs]
+            while any(status in ACTIVE for status in statuses):
+                time.sleep(WAIT_INTERVAL)
+                jobs.poll()
+                if [job.status for job in self.jobs] != statuses:
+                    statuses = [job.status for job in self.jobs]
+                    self.write_index()
+        return jobs
+
+    def write_index(self):
+        """Writes the index of outputs: one row per variant with its values, .fits file, status
+        and working folder.
+        """
+        keys = list(self.values)
+        with open(self.output_dir / INDEX_FILE, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['variant'] + keys +
+                            ['fits_file', 'status', 'returncode', 'run_dir'])
+            for k, (variant, job) in enumerate(zip(self.variants, self.jobs)):
+                writer.writerow([k] + [variant[key] for key in keys] +
+                                [str(self.fits_file(k)), job.status, job.returncode, str(job.run_dir)])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs an IDEATE model with several values of some parameters.')
+    parser.add_argument('sweep_file', help='sweep definition file')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only lists the variants')
+    args = parser.parse_args()
+
+    sweep = Sweep(args.sweep_file)
+    for k, variant in enumerate(sweep.variants):
+        print(str(k) + ': ' + ', '.join(key + ' = ' + val for key, val in variant.items()))
+    if not args.dry_run:
+        sweep.run()
+        print('Index of outputs: ' + str(sweep.output_dir / INDEX_FILE))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 import textwrap
 import tkinter as tk
 from tkinter import ttk
-import pandas as pd
 
 
 class ToolTip(object):
@@ -172,47 +171,50 @@ class HyperlinkManager:
                 return
 
 
-def check_format(shape_file, datos_vars):
-    """Function to check if tabulated file format is what we expect. It expects datos_vars 
-    variables to be the columns of the file, and if velocity (v) is on the list, it expects 
-    'vx', 'vy' and 'vz' columns. It is case insensitive and it expects the delimitator to be \t.
+class SearchIndex:
+    """Case insensitive substring search over a list of names. Names are indexed by their
+    lowercase n-grams, so only names having all the n-grams of the query are checked, and a query
+    containing the previous one only checks the previous matches (e.g. while typing).
+    """
 
-    Args:
-        shape_file (str): complete path to where the tabulated data file is located.
-        datos_vars (list): list with the variables name expected to appear on the file header.
+    NGRAM = 3
 
-    Raises:
-        Exception: _description_
-    """
-    df = pd.read_csv(shape_file, sep='\t')
-    flag = True
-    err_msg = ""
-    df_columns_lower = [x.lower() for x in df.columns]
-    for var in datos_vars.keys():
-        if datos_vars[var] is True:
-            if var != "velocity":
-                if var not in df_columns_lower:
-                    err_msg += ("La columna " + str(var) +
-                                " no está en el fichero.\n")
-                    flag = False
-            else:
-                for v in ['vx', 'vy', 'vz']:
-                    if v not in df_columns_lower:
-                        err_msg += ("La columna " + str(var) +
-                                    ' (' + str(v) + ") no está en el fichero.\n")
-                        flag = False
-    if flag is False:
-        raise Exception(
-            err_msg + "El fichero no tiene el formato correcto.")
-
-
-def str2bool(txt):
-    """Transforms str (true o 1) to boolean (True).
+    def __init__(self, names):
+        """
+        Args:
+            names (list): names to search in.
+        """
+        self.names = list(names)
+        self.lower_names = [name.lower() for name in self.names]
+        self.ngrams = {}    # {ngram: set of name positions}
+        for pos, name in enumerate(self.lower_names):
+            for k in range(len(name) - self.NGRAM + 1):
+                self.ngrams.setdefault(name[k:k + self.NGRAM], set()).add(pos)
 
-    Args:
-        txt (str): text to transform.
+        self.last_query = ''
+        self.last_matches = list(range(len(self.names)))
 
-    Returns:
-        bool: True if text equals true or 1, else False.
-    """
-    return txt.lower() in ['true', '1']
+    def search(self, query):
+        """Names containing query.
+
+        Args:
+            query (str): text to search.
+
+        Returns:
+            list: matching names, in the same order as the indexed names.
+        """
+        query = query.lower()
+        if query == '':
+            candidates = range(len(self.names))
+        elif len(self.last_query) > 0 and self.last_query in query:
+            candidates = self.last_matches
+        elif len(query) >= self.NGRAM:
+            sets = sorted((self.ngrams.get(query[k:k + self.NGRAM], set())
+                           for k in range(len(query) - self.NGRAM + 1)), key=len)
+            candidates = sorted(set.intersection(*sets))
+        else:
+            candidates = range(len(self.names))
+
+        self.last_query = query
+        self.last_matches = [pos for pos in candidates if query in self.lower_names[pos]]
+        return [self.names[pos] for pos in self.last_matches]
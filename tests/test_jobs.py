@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+
+from jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return JobManager(tmp_path / 'jobs', max_running=1)
+
+
+def test_job_runs_in_its_own_folder(manager):
+    job = manager.submit('a', 'cat input.txt', files={'input.txt': 'hello'})
+    manager.wait(job.job_id, interval=0.01)
+    assert job.status == DONE
+    assert job.returncode == 0
+    assert job.stdout_path.read_text() == 'hello'
+    assert job.run_dir.parent == manager.jobs_dir
+
+
+def test_failed_command(manager):
+    job = manager.submit('a', 'exit 3')
+    manager.wait(job.job_id, interval=0.01)
+    assert job.status == FAILED
+    assert job.returncode == 3
+
+
+def test_jobs_queue_at_max_running(tmp_path):
+    manager = JobManager(tmp_path / 'jobs', max_running=2)
+    jobs = [manager.submit(str(k), 'sleep 0.2') for k in range(3)]
+    assert [job.status for job in jobs] == [RUNNING, RUNNING, QUEUED]
+    manager.wait(interval=0.01)
+    assert [job.status for job in jobs] == [DONE, DONE, DONE]
+    assert jobs[2].start_time >= min(jobs[0].end_time, jobs[1].end_time)
+
+
+def test_duplicate_active_key_is_rejected(manager):
+    job = manager.submit('a', 'sleep 5', key='model')
+    with pytest.raises(Exception):
+        manager.submit('b', 'true', key='model')
+    manager.cancel(job.job_id)
+    manager.submit('c', 'true', key='model')  # the first one is not active anymore
+
+
+def test_cancel_queued_job(manager):
+    running = manager.submit('a', 'sleep 5')
+    queued = manager.submit('b', 'true')
+    manager.cancel(queued.job_id)
+    assert queued.status == CANCELLED
+    assert queued.start_time is None
+    manager.cancel(running.job_id)
+
+
+def test_cancel_running_job(manager):
+    job = manager.submit('a', 'sleep 5')
+    start = time.time()
+    manager.cancel(job.job_id)
+    assert time.time() - start < 1  # it doesn't wait for the process
+    assert job.status == CANCELLED
+    deadline = time.time() + 5
+    while job.returncode is None and time.time() < deadline:
+        time.sleep(0.01)
+        manager.poll()
+    assert job.returncode is not None  # reaped by a later poll
+    assert job.status == CANCELLED
+
+
+def test_cancel_all_does_not_start_queued_jobs(manager):
+    jobs = [manager.submit(str(k), 'sleep 5') for k in range(3)]
+    manager.cancel_all()
+    assert [job.status for job in jobs] == [CANCELLED] * 3
+    assert jobs[1].start_time is None
+    assert jobs[2].start_time is None
+
+
+def test_launch_failure_fails_the_job(manager):
+    broken = manager.submit('a', 'true', copy_files=[os.path.join(str(manager.jobs_dir), 'missing')])
+    job = manager.submit('b', 'true')
+    manager.wait(interval=0.01)
+    assert broken.status == FAILED
+    assert 'could not be started' in broken.stderr_path.read_text()
+    assert job.status == DONE
@@ -0,0 +1,82 @@
+import numpy
+import pandas as pd
+import pytest
+
+import shape_data
+from shape_data import COORDS, FIELD_DTYPE, ShapeCache, read_shape, scan_shape
+
+
+@pytest.fixture
+def shape_file(tmp_path):
+    """Shape tabulated data file as written by ShapeX: a text first column, an unnamed last one,
+    some rows without coordinates and some NaN values."""
+    rng = numpy.random.RandomState(0)
+    n = 2000
+    data = pd.DataFrame({'Object, Species': 'obj, sp',
+                         'Px': rng.uniform(-100, 100, n), 'Py': rng.uniform(-100, 100, n),
+                         'Pz': rng.uniform(-100, 100, n), 'Density': rng.uniform(1e3, 1e4, n),
+                         'Temperature': rng.uniform(10, 100, n), 'Unnamed': ''})
+    data.loc[rng.choice(n, 50, replace=False), 'Px'] = numpy.nan
+    data.loc[rng.choice(n, 30, replace=False), 'Density'] = numpy.nan
+    path = tmp_path / 'shape.txt'
+    data.to_csv(path, sep='\t', index=False)
+    return str(path)
+
+
+def pandas_read(shape_file):
+    return pd.read_csv(shape_file, sep='\t').dropna(subset=COORDS)
+
+
+@pytest.mark.parametrize('workers, range_bytes', [(1, 1 << 25), (1, 4096), (3, 4096)])
+def test_read_shape_matches_pandas(shape_file, workers, range_bytes):
+    expected = pandas_read(shape_file)
+    data = read_shape(shape_file, ['density', 'Temperature'], workers=workers,
+                      range_bytes=range_bytes)
+    assert sorted(data) == sorted(COORDS + ['density', 'Temperature'])
+    for c in COORDS:
+        numpy.testing.assert_array_equal(data[c], expected[c].to_numpy())
+    numpy.testing.assert_array_equal(data['density'],
+                                     expected['Density'].to_numpy(dtype=FIELD_DTYPE))
+    numpy.testing.assert_array_equal(data['Temperature'],
+                                     expected['Temperature'].to_numpy(dtype=FIELD_DTYPE))
+
+
+def test_read_shape_missing_column(shape_file):
+    with pytest.raises(Exception):
+        read_shape(shape_file, ['Velocity'])
+
+
+def test_shape_cache_round_trip(shape_file, tmp_path):
+    expected = pandas_read(shape_file)
+    fields = {'coords': (COORDS, 2.0), 'density': ('Density', 10.0)}
+    cache_dir = str(tmp_path / 'cache')
+
+    built = ShapeCache(shape_file, fields, cache_dir).arrays()
+    loaded = ShapeCache(shape_file, fields, cache_dir).arrays()  # from the cache entry
+    for arrays in (built, loaded):
+        numpy.testing.assert_array_equal(arrays['coords'], expected[COORDS].to_numpy() * 2.0)
+        numpy.testing.assert_allclose(arrays['density'],
+                                      expected['Density'].to_numpy() * 10.0, rtol=1e-6)
+    assert isinstance(loaded['coords'], numpy.memmap)
+
+    # Another conversion of the same file is another entry
+    other = ShapeCache(shape_file, {'coords': (COORDS, 1.0)}, cache_dir)
+    numpy.testing.assert_array_equal(other.arrays()['coords'], expected[COORDS].to_numpy())
+
+
+def test_scan_shape_shared_with_shape_cache(shape_file, tmp_path, monkeypatch):
+    expected = pandas_read(shape_file)
+    cache_dir = str(tmp_path / 'cache')
+    cache = ShapeCache(shape_file, {'coords': (COORDS, 2.0), 'density': ('Density', 1.0)},
+                       cache_dir)
+    cache.arrays()
+
+    def read_again(*args, **kwargs):
+        raise AssertionError('the shape file was read again')
+    monkeypatch.setattr(shape_data, 'read_shape', read_again)
+    stats = scan_shape(shape_file, ['density'], cache_dir)
+    assert stats == cache.stats()
+    assert stats['n_points'] == len(expected)
+    assert stats['columns']['Density']['nan'] == int(expected['Density'].isna().sum())
+    assert stats['columns']['Px']['min'] == expected['Px'].min()
+    assert stats['columns']['Density']['max'] == pytest.approx(expected['Density'].max(), rel=1e-6)